@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# Pages diffed per second by the diff process pool at different numbers
+# of worker processes. Pages are handed over in shared memory, from as
+# many submitting threads as there are workers.
+#
+# Usage: benchmarks/diff_scaling.py [--pages=256] [--width=1280] [--workers=1,4,16,32]
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "src"))
+
+import numpy as np
+
+from dapscompare.diffpool import DiffExecutor
+
+
+def makePages(width):
+    height = int(width * 1.4142)
+    random = np.random.RandomState(0)
+    imgRef = np.full((height, width, 3), 255, dtype=np.uint8)
+    imgRef[::4][random.randint(0, 2, size=(height // 4, width)).astype(bool)] = 0
+    imgComp = imgRef.copy()
+    # a changed paragraph
+    imgComp[height // 3:height // 3 + 40, 100:width - 100] = 0
+    return imgRef, imgComp
+
+
+def bench(workers, pages, imgRef, imgComp, target):
+    executor = DiffExecutor()
+    executor.start(workers)
+    # warm up the worker processes
+    jobs = [executor.submit(imgRef, imgComp, os.path.join(target, "warmup-%d.png" % n)) for n in range(0, workers)]
+    for job in jobs:
+        job.result()
+
+    def submitter(count, threadX):
+        pending = []
+        for n in range(0, count):
+            pending.append(executor.submit(imgRef, imgComp, os.path.join(target, "%d-%d.png" % (threadX, n))))
+            if len(pending) >= 4:
+                pending.pop(0).result()
+        for job in pending:
+            job.result()
+
+    start = time.time()
+    threads = [threading.Thread(target=submitter, args=(pages // workers, threadX)) for threadX in range(0, workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.time() - start
+    executor.stop()
+    return (pages // workers) * workers / duration
+
+
+def main():
+    pages = 256
+    width = 1280
+    workerCounts = [1, 4, 16, 32]
+    for parameter in sys.argv[1:]:
+        if parameter.startswith("--pages="):
+            pages = int(parameter[8:])
+        elif parameter.startswith("--width="):
+            width = int(parameter[8:])
+        elif parameter.startswith("--workers="):
+            workerCounts = [int(value) for value in parameter[10:].split(",")]
+    imgRef, imgComp = makePages(width)
+    target = tempfile.mkdtemp()
+    for workers in workerCounts:
+        print("%3d workers %8.1f pages/s" % (workers, bench(workers, pages, imgRef, imgComp, target)))
+    shutil.rmtree(target)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+# Compare startup and per-page latency of the HTML render backends.
+#
+# Usage: benchmarks/html_render.py [--width=1280] FILE.html [FILE.html ...]
+
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "src"))
+
+from dapscompare.renderers import renderHtml, HtmlRenderServer
+
+
+def benchProcess(pages, width, target):
+    latencies = []
+    for page in pages:
+        start = time.time()
+        renderHtml(page, [(width, target)])
+        latencies.append(time.time() - start)
+    return None, latencies
+
+
+def benchServer(pages, width, target):
+    start = time.time()
+    server = HtmlRenderServer()
+    # the first page includes loading QtWebKit
+    server.render(pages[0], [(width, target)])
+    startup = time.time() - start
+    latencies = []
+    for page in pages:
+        start = time.time()
+        server.render(page, [(width, target)])
+        latencies.append(time.time() - start)
+    server.stop()
+    return startup, latencies
+
+
+def report(name, startup, latencies):
+    latencies = sorted(latencies)
+    print(name)
+    if startup is not None:
+        print("  startup + first page: %.3f s" % startup)
+    print("  pages:  %d" % len(latencies))
+    print("  mean:   %.3f s" % (sum(latencies) / len(latencies)))
+    print("  median: %.3f s" % latencies[len(latencies) // 2])
+    print("  max:    %.3f s" % latencies[-1])
+
+
+def main():
+    width = 1280
+    pages = []
+    for parameter in sys.argv[1:]:
+        if parameter.startswith("--width="):
+            width = int(parameter[8:])
+        else:
+            pages.append(os.path.realpath(parameter))
+    if len(pages) == 0:
+        print("Usage: html_render.py [--width=1280] FILE.html [FILE.html ...]")
+        sys.exit(1)
+    target = tempfile.mkdtemp()
+    report("process (one html2png.py per page)", *benchProcess(pages, width, target))
+    report("server (persistent html2png.py)", *benchServer(pages, width, target))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+# Measure how many HTML slices per second html2png can write with each
+# output format and compression level, compared to the old
+# QBuffer -> BytesIO -> PIL path.
+#
+# Usage: benchmarks/html_slices.py [--width=1280] [--slices=50]
+
+import os
+import sys
+import time
+import tempfile
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "src"))
+
+from PIL import Image
+from PyQt4.QtCore import QBuffer, QIODevice, QRect, Qt
+from PyQt4.QtGui import QApplication, QImage, QPainter, QColor, QFont
+
+from dapscompare.html2png import saveImage
+
+
+def oldSaveOptPNG(img, path):
+    buffer = QBuffer()
+    buffer.open(QIODevice.ReadWrite)
+    img.save(buffer, "PNG")
+    strio = BytesIO()
+    strio.write(buffer.data())
+    buffer.close()
+    strio.seek(0)
+    pil_im = Image.open(strio)
+    pil_im.save(path, "PNG", optimize=False, compress_level=9)
+
+
+# a slice that looks roughly like a page of text
+def makeSlice(width):
+    height = int(width * 1.4142 - 1)
+    image = QImage(width, height, QImage.Format_RGB32)
+    image.fill(QColor(Qt.white).rgb())
+    painter = QPainter(image)
+    painter.setFont(QFont("Sans", 11))
+    for line in range(0, height // 20):
+        painter.drawText(QRect(40, line * 20, width - 80, 20), 0, "The quick brown fox jumps over the lazy dog %d. " % line * 3)
+    painter.end()
+    return image
+
+
+def bench(name, save, image, slices, target):
+    start = time.time()
+    for n in range(0, slices):
+        save(image, os.path.join(target, "%s.%d" % (name, n)))
+    duration = time.time() - start
+    size = os.path.getsize(os.path.join(target, "%s.0" % name))
+    print("%-12s %8.1f slices/s %10d bytes/slice" % (name, slices / duration, size))
+
+
+def main():
+    width = 1280
+    slices = 50
+    for parameter in sys.argv[1:]:
+        if parameter.startswith("--width="):
+            width = int(parameter[8:])
+        elif parameter.startswith("--slices="):
+            slices = int(parameter[9:])
+    app = QApplication(sys.argv)
+    image = makeSlice(width)
+    target = tempfile.mkdtemp()
+    bench("old-png-9", oldSaveOptPNG, image, slices, target)
+    for level in [9, 6, 1, 0]:
+        bench("png-%d" % level, lambda img, path: saveImage(img, path, "png", level), image, slices, target)
+    bench("ppm", lambda img, path: saveImage(img, path, "ppm"), image, slices, target)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+# Pages per second of runTests on a suite where every page is identical,
+# with and without comparing page checksums first.
+#
+# Usage: benchmarks/identical_pages.py [--pages=500] [--width=1280]
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "src"))
+
+import numpy as np
+from scipy.misc import imsave
+
+from dapscompare.helpers import MyConfig, DataCollector, registerHash, runTests, writeManifest, pageDigests
+
+
+def makeSuite(directory, pages, width):
+    testcase = directory+"testcase/"
+    # options added later get their defaults from MyConfig
+    sys.argv = ["dapscmp", "compare", "--testcases="+directory, "--no-gui", "--json", "--ignore-conf"]
+    cfg = MyConfig()
+    dataCollection = DataCollector(cfg)
+    md5 = registerHash({'Type': 'pdf', 'testcase': testcase}, dataCollection)
+    # a page with some text-like noise, so PNG decoding takes realistic time
+    height = int(width * 1.4142)
+    page = np.full((height, width, 3), 255, dtype=np.uint8)
+    rows = np.random.RandomState(0).randint(0, 2, size=(len(page[::4]), width)).astype(bool)
+    page[::4][rows] = 0
+    for folder in ["dapscompare-reference", "dapscompare-comparison"]:
+        os.makedirs(testcase+folder+"/"+md5)
+        imsave(testcase+folder+"/"+md5+"/page-000.png", page)
+        for n in range(1, pages):
+            shutil.copyfile(testcase+folder+"/"+md5+"/page-000.png", testcase+folder+"/"+md5+"/page-%03d.png" % n)
+        writeManifest(testcase+folder+"/"+md5+"/", {'pages': pageDigests(testcase+folder+"/"+md5+"/")})
+    return cfg, dataCollection, testcase
+
+
+def main():
+    pages = 500
+    width = 1280
+    for parameter in sys.argv[1:]:
+        if parameter.startswith("--pages="):
+            pages = int(parameter[8:])
+        elif parameter.startswith("--width="):
+            width = int(parameter[8:])
+    directory = tempfile.mkdtemp()+"/"
+    cfg, dataCollection, testcase = makeSuite(directory, pages, width)
+    for hashCheck in [False, True]:
+        cfg.hashCheck = hashCheck
+        start = time.time()
+        runTests(cfg, dataCollection, testcase)
+        duration = time.time() - start
+        print("hash check %-5s %8.1f pages/s" % (hashCheck, pages / duration))
+    shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+# Compare the PDF render backends on pages per second and peak RSS.
+# Every backend runs in its own Python process, so the RSS numbers do not
+# influence each other. For imagemagick the peak RSS of convert and
+# Ghostscript is reported separately.
+#
+# Usage: benchmarks/pdf_backends.py FILE.pdf [backend ...]
+
+import os
+import sys
+import json
+import time
+import resource
+import tempfile
+import subprocess
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "src"))
+
+
+def runBackend(backend, pathPdf):
+    from dapscompare.renderers import pdfBackends
+    cfg = SimpleNamespace(pdfBackend=backend, pdfParallel=True, pdfChunk=0, pdfDensity=110)
+    target = tempfile.mkdtemp()
+    start = time.time()
+    pdfBackends[backend].render(cfg, [(pathPdf, 100, target)])
+    duration = time.time() - start
+    print(json.dumps({
+        'pages': len(os.listdir(target)),
+        'seconds': duration,
+        # ru_maxrss is in KiB on Linux
+        'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'childRss': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }))
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == "--run":
+        runBackend(sys.argv[2], sys.argv[3])
+        return
+    if len(sys.argv) < 2:
+        print("Usage: pdf_backends.py FILE.pdf [backend ...]")
+        sys.exit(1)
+    pathPdf = os.path.realpath(sys.argv[1])
+    backends = sys.argv[2:] or ["imagemagick", "mupdf"]
+    print("%-12s %6s %10s %12s %14s" % ("backend", "pages", "pages/s", "peak RSS", "child RSS"))
+    for backend in backends:
+        output = subprocess.check_output([sys.executable, os.path.realpath(__file__), "--run", backend, pathPdf])
+        result = json.loads(output.decode().splitlines()[-1])
+        print("%-12s %6d %10.2f %9.1f MB %11.1f MB" % (backend, result['pages'], result['pages'] / result['seconds'], result['rss'] / 1024, result['childRss'] / 1024))
+
+
+if __name__ == "__main__":
+    main()
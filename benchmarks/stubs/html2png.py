@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+# Stand-in for html2png.py with the same command line and --server
+# protocol. Like html2png.py, every target is cut into slices as high as
+# the width times 1.4142, written to TARGET with ".N.png" instead of
+# ".png". The stub document has one slice per page.
+
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+from stubpages import readDocument, pageRows, writePng, writePpm, sleep
+
+
+def render(source, targets, format="png", compression=9):
+    document = readDocument(source)
+    for width, target in targets:
+        width = int(width)
+        sliceHeight = int(width * 1.4142 - 1)
+        for x in range(0, document['pages']):
+            sleep("STUB_PAGE_LATENCY")
+            rows = pageRows(width, sliceHeight, document['seed'], x, x in document['changed'])
+            path = target[:-4]+"."+str(x)+"."+format
+            if format == "ppm":
+                writePpm(path, width, sliceHeight, rows)
+            else:
+                writePng(path, width, sliceHeight, rows, compression)
+    return True
+
+
+def main():
+    if sys.argv[1] == "--server":
+        for line in iter(sys.stdin.readline, ''):
+            if not line.strip():
+                continue
+            job = json.loads(line)
+            result = render(job['source'], job['targets'], job.get('format', "png"), job.get('compression', 9))
+            sys.stdout.write(json.dumps({'ok': result})+"\n")
+            sys.stdout.flush()
+        return 0
+    format = "png"
+    compression = 9
+    args = []
+    for parameter in sys.argv[1:]:
+        if parameter.startswith("--format="):
+            format = parameter[9:]
+        elif parameter.startswith("--compression="):
+            compression = int(parameter[14:])
+        else:
+            args.append(parameter)
+    render(args[0], [(args[n + 1], args[n]) for n in range(1, len(args) - 1, 2)], format, compression)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+# Deterministic pages for the stand-in daps, gs, convert and html2png of
+# the synthetic benchmark. A stub "PDF" or "HTML" file is JSON:
+# {"pages": 40, "seed": 7, "changed": [3, 17]}. Every page is a white
+# page with lines of black "words"; changed pages have one word moved.
+
+import os
+import json
+import time
+import zlib
+import random
+import struct
+
+# A4 in inches
+pageWidth = 8.27
+pageHeight = 11.69
+
+
+def readDocument(path):
+    f = open(path, 'r')
+    content = f.read()
+    f.close()
+    try:
+        # HTML stubs wrap the JSON in a comment
+        return json.loads(content[content.index("{"):content.rindex("}") + 1])
+    except ValueError:
+        return {'pages': 1, 'seed': 0, 'changed': []}
+
+
+# seconds every stub process sleeps, to stand in for the real programs
+def sleep(variable, count=1):
+    time.sleep(float(os.environ.get(variable, "0")) * count)
+
+
+# rows of RGB bytes of one page
+def pageRows(width, height, seed, page, changed):
+    generator = random.Random(seed * 100003 + page)
+    white = b"\xff\xff\xff" * width
+    lineHeight = max(height // 60, 4)
+    rows = []
+    y = lineHeight * 3
+    while len(rows) < height:
+        if len(rows) < y or len(rows) > height - lineHeight * 3:
+            rows.append(white)
+            continue
+        # a line of words
+        line = bytearray(white)
+        x = width // 10
+        words = []
+        while x < width * 9 // 10:
+            length = generator.randint(width // 60, width // 12)
+            words.append((x, min(x + length, width * 9 // 10)))
+            x = x + length + width // 80
+        # drawn on every page, so a changed page differs from the
+        # unchanged one only where a word moved
+        r = generator.random()
+        if changed and len(words) > 0 and r < 0.1:
+            start, end = words[-1]
+            words[-1] = (start + width // 40, min(end + width // 40, width - 1))
+        for start, end in words:
+            line[start * 3:end * 3] = b"\x00\x00\x00" * (end - start)
+        rows.extend([bytes(line)] * (lineHeight * 2 // 3))
+        rows.extend([white] * (lineHeight - lineHeight * 2 // 3))
+        y = len(rows)
+    return rows[:height]
+
+
+def writePng(path, width, height, rows, compression=6):
+    raw = b"".join(b"\x00" + row for row in rows)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    f = open(path, 'wb')
+    f.write(b"\x89PNG\r\n\x1a\n")
+    f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+    f.write(chunk(b"IDAT", zlib.compress(raw, compression)))
+    f.write(chunk(b"IEND", b""))
+    f.close()
+
+
+def writePpm(path, width, height, rows):
+    f = open(path, 'wb')
+    f.write(("P6\n%d %d\n255\n" % (width, height)).encode('ascii'))
+    for row in rows:
+        f.write(row)
+    f.close()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+# Reference and compare runs over generated testcases, with the stand-in
+# daps, gs, convert and html2png.py of benchmarks/stubs instead of the real
+# tool chain. Measures the duration of spawnWorkerThreads for both runs,
+# of runTests alone and of findRegions, which finds the regions the
+# viewer marks. With --save-baseline the numbers are stored in
+# benchmarks/baseline.json for this set of parameters; later runs are
+# compared to them.
+#
+# Usage: benchmarks/synthetic.py [--testcases=8] [--dc=2] [--pages=40]
+#        [--filetypes=pdf] [--html-width=800,1280] [--changes=3]
+#        [--daps-latency=0.2] [--page-latency=0.01] [--density=110]
+#        [--save-baseline] [--keep]
+#
+# --changes pages of every DC file differ between reference and
+# comparison. Latencies are seconds per daps call and per rendered page.
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "src"))
+
+import numpy as np
+from PyQt5 import QtCore
+
+from dapscompare.helpers import MyConfig, DataCollector, spawnWorkerThreads, runTests, listFiles
+from dapscompare.diff import findRegions
+from dapscompare.diffpool import diffExecutor
+
+benchmarks = os.path.dirname(os.path.realpath(__file__))
+stubs = os.path.join(benchmarks, "stubs")
+baselinePath = os.path.join(benchmarks, "baseline.json")
+
+# slower than the baseline by more than this is reported
+regressionFactor = 1.1
+
+
+def writeDcFile(path, pages, seed, changed):
+    f = open(path, 'w')
+    f.write("MAIN=book.xml\nPAGES=%d\nSEED=%d\nCHANGED=%s\n" % (pages, seed, ",".join(str(page) for page in changed)))
+    f.close()
+
+
+def makeTestcases(directory, testcases, dcFiles, pages):
+    for n in range(0, testcases):
+        testcase = os.path.join(directory, "testcase-%03d" % n)
+        os.makedirs(testcase)
+        for m in range(0, dcFiles):
+            writeDcFile(os.path.join(testcase, "DC-doc%d" % m), pages, n * 1000 + m, [])
+
+
+# the comparison build gets changes pages per DC file
+def injectChanges(directory, testcases, dcFiles, pages, changes):
+    generator = random.Random(0)
+    for n in range(0, testcases):
+        for m in range(0, dcFiles):
+            changed = sorted(generator.sample(range(0, pages), min(changes, pages)))
+            writeDcFile(os.path.join(directory, "testcase-%03d" % n, "DC-doc%d" % m), pages, n * 1000 + m, changed)
+
+
+def makeConfig(mode, directory, options):
+    sys.argv = ["dapscmp", mode, "--testcases="+directory, "--tools="+stubs, "--no-gui", "--json", "--ignore-conf", "--no-build-cache", "--no-render-cache", "--no-history"] + options
+    return MyConfig()
+
+
+def timeRun(mode, directory, options):
+    cfg = makeConfig(mode, directory, options)
+    dataCollection = DataCollector(cfg)
+    start = time.time()
+    spawnWorkerThreads(cfg, dataCollection)
+    return time.time() - start
+
+
+def timeRunTests(directory, options):
+    cfg = makeConfig("compare", directory, options)
+    dataCollection = DataCollector(cfg)
+    testcases = [os.path.join(directory, name)+"/" for name in sorted(os.listdir(directory)) if name.startswith("testcase-")]
+    diffExecutor.start(cfg.diffWorkers)
+    start = time.time()
+    for testcase in testcases:
+        runTests(cfg, dataCollection, testcase)
+    duration = time.time() - start
+    diffExecutor.stop()
+    dataCollection.journal.finish()
+    return duration
+
+
+def countPages(directory):
+    pages = 0
+    for root, dirs, files in os.walk(directory):
+        if os.path.basename(os.path.dirname(root)) == "dapscompare-reference" and not root.endswith(".sources"):
+            pages = pages + len(listFiles(root))
+    return pages
+
+
+# masks with a few changed paragraphs, of the size of PDF pages
+def timeFindRegions(density, count=50):
+    height, width = int(11.69 * density), int(8.27 * density)
+    generator = np.random.RandomState(0)
+    masks = []
+    for n in range(0, count):
+        mask = np.zeros((height, width), dtype=bool)
+        for region in range(0, 5):
+            y, x = generator.randint(0, height - 40), generator.randint(0, width - 200)
+            mask[y:y + 40, x:x + 200] = generator.randint(0, 2, size=(40, 200)).astype(bool)
+        masks.append(mask)
+    start = time.time()
+    for mask in masks:
+        findRegions(mask)
+    return (time.time() - start) / count * 1000
+
+
+def readBaseline():
+    if not os.path.exists(baselinePath):
+        return {}
+    f = open(baselinePath, 'r')
+    content = json.load(f)
+    f.close()
+    return content
+
+
+def writeBaseline(baseline):
+    f = open(baselinePath, 'w')
+    f.write(json.dumps(baseline, indent=2, sort_keys=True)+"\n")
+    f.close()
+
+
+def main():
+    testcases = 8
+    dcFiles = 2
+    pages = 40
+    changes = 3
+    density = 110
+    options = []
+    saveBaseline = False
+    keep = False
+    for parameter in sys.argv[1:]:
+        if parameter.startswith("--testcases="):
+            testcases = int(parameter[12:])
+        elif parameter.startswith("--dc="):
+            dcFiles = int(parameter[5:])
+        elif parameter.startswith("--pages="):
+            pages = int(parameter[8:])
+        elif parameter.startswith("--changes="):
+            changes = int(parameter[10:])
+        elif parameter.startswith("--density="):
+            density = int(parameter[10:])
+            options.append("--pdf-density="+str(density))
+        elif parameter.startswith("--daps-latency="):
+            os.environ['STUB_DAPS_LATENCY'] = parameter[15:]
+        elif parameter.startswith("--page-latency="):
+            os.environ['STUB_PAGE_LATENCY'] = parameter[15:]
+        elif parameter.startswith("--filetypes=") or parameter.startswith("--html-width="):
+            options.append(parameter)
+        elif parameter == "--save-baseline":
+            saveBaseline = True
+        elif parameter == "--keep":
+            keep = True
+    if not any(option.startswith("--filetypes=") for option in options):
+        options.append("--filetypes=pdf")
+
+    # QThreads of the pipeline need an application object
+    app = QtCore.QCoreApplication(sys.argv[:1])
+    directory = tempfile.mkdtemp(prefix="dapscompare-synthetic-")+"/"
+    makeTestcases(directory, testcases, dcFiles, pages)
+
+    results = {}
+    results['reference s'] = timeRun("reference", directory, options)
+    injectChanges(directory, testcases, dcFiles, pages, changes)
+    results['compare s'] = timeRun("compare", directory, options)
+    results['runTests s'] = timeRunTests(directory, options)
+    results['findRegions ms/page'] = timeFindRegions(density)
+    totalPages = countPages(directory)
+
+    if keep:
+        print("Testcases kept in "+directory)
+    else:
+        shutil.rmtree(directory)
+
+    key = " ".join(["testcases=%d" % testcases, "dc=%d" % dcFiles, "pages=%d" % pages, "changes=%d" % changes, "daps-latency="+os.environ.get('STUB_DAPS_LATENCY', "0"), "page-latency="+os.environ.get('STUB_PAGE_LATENCY', "0")] + sorted(options))
+    baseline = readBaseline()
+    print(key)
+    print("%d reference pages\n" % totalPages)
+    for name in sorted(results):
+        line = "%-22s %10.3f" % (name, results[name])
+        if key in baseline and name in baseline[key]:
+            before = baseline[key][name]
+            line = line + "   baseline %10.3f" % before
+            if before > 0 and results[name] > before * regressionFactor:
+                line = line + "   SLOWER by %.0f %%" % (100 * (results[name] / before - 1))
+        print(line)
+    print("\n%.1f pages/s compared by runTests" % (totalPages / max(results['runTests s'], 1e-9)))
+
+    if saveBaseline:
+        baseline[key] = results
+        writeBaseline(baseline)
+        print("Baseline written to "+baselinePath)
+    elif key not in baseline:
+        print("\nno baseline for this key, --save-baseline stores one")
+
+
+if __name__ == "__main__":
+    main()
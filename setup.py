@@ -34,7 +34,7 @@ setupdict = dict(
    # simple. Or you can use find_packages().
    packages=find_packages('src'),
    package_dir={'': 'src'},
-   install_requires=['PyQt4','scipy', 'numpy', 'Pillow'],
+   install_requires=['PyQt4','scipy', 'numpy', 'Pillow', 'psutil'],
    # have to be included in MANIFEST.in as well.
    package_data={
         '': ['src/dapscompare/README'],
@@ -0,0 +1,118 @@
+# The MIT License (MIT)
+# 
+# Copyright (c) 2017, Sven Seeberg-Elverfeldt <sseebergelverfeldt@suse.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# Pairing of reference and comparison pages when a document has gained
+# or lost pages. Every page of the two documents gets a 64 bit
+# difference hash; the two sequences of hashes are aligned with dynamic
+# programming, so inserted and removed pages are found without
+# comparing the pages themselves.
+
+import os
+import re
+
+import numpy as np
+from PIL import Image
+
+# pairing two pages costs the number of differing hash bits, leaving a
+# page unpaired costs gapCost. Pages differing in less than 2 * gapCost
+# bits are paired rather than treated as removed and inserted.
+gapCost = 16
+
+# number of set bits of every byte value
+bitCount = np.array([bin(n).count("1") for n in range(256)], dtype=np.uint8)
+
+
+# sort page-9.png before page-10.png
+def pageSortKey(filename):
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", filename)]
+
+
+# difference hash: compare neighbouring pixels of a 9x8 thumbnail
+def perceptualHash(path):
+    image = Image.open(path)
+    pixels = np.asarray(image.convert("L").resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return "%016x" % int("".join(["1" if bit else "0" for bit in bits]), 2)
+
+
+def hashDistances(refHashes, compHashes):
+    ref = np.array([int(value, 16) for value in refHashes], dtype=np.uint64).view(np.uint8).reshape(len(refHashes), 8)
+    comp = np.array([int(value, 16) for value in compHashes], dtype=np.uint64).view(np.uint8).reshape(len(compHashes), 8)
+    return bitCount[ref[:, np.newaxis, :] ^ comp[np.newaxis, :, :]].sum(axis=2, dtype=np.int32)
+
+
+# returns a list of (reference index, comparison index) pairs in page
+# order. A page without partner has None on the other side.
+def alignPages(refHashes, compHashes):
+    n = len(refHashes)
+    m = len(compHashes)
+    distances = hashDistances(refHashes, compHashes).tolist() if n > 0 and m > 0 else [[]] * n
+    # cost[i][j]: cheapest alignment of the first i reference and j comparison pages
+    cost = [[0] * (m + 1) for i in range(0, n + 1)]
+    for i in range(1, n + 1):
+        cost[i][0] = i * gapCost
+    for j in range(1, m + 1):
+        cost[0][j] = j * gapCost
+    for i in range(1, n + 1):
+        row = cost[i]
+        previous = cost[i - 1]
+        rowDistances = distances[i - 1]
+        for j in range(1, m + 1):
+            row[j] = min(previous[j - 1] + rowDistances[j - 1], previous[j] + gapCost, row[j - 1] + gapCost)
+    # walk back from the end
+    pairs = []
+    i = n
+    j = m
+    while i > 0 or j > 0:
+        if i > 0 and j > 0 and cost[i][j] == cost[i - 1][j - 1] + distances[i - 1][j - 1]:
+            pairs.append((i - 1, j - 1))
+            i = i - 1
+            j = j - 1
+        elif i > 0 and cost[i][j] == cost[i - 1][j] + gapCost:
+            pairs.append((i - 1, None))
+            i = i - 1
+        else:
+            pairs.append((None, j - 1))
+            j = j - 1
+    pairs.reverse()
+    return pairs
+
+
+# hashes of the given pages, from the manifest of the folder if possible.
+# Computed hashes are added to manifest['phash']; returns the hashes and
+# whether any had to be computed.
+def folderHashes(folder, pages, manifest):
+    stored = manifest.setdefault('phash', {})
+    computed = False
+    for page in pages:
+        if page not in stored:
+            stored[page] = perceptualHash(os.path.join(folder, page))
+            computed = True
+    return [stored[page] for page in pages], computed
+
+
+# pair the pages of a reference and a comparison folder. Returns the
+# list of (reference page, comparison page) pairs, the removed reference
+# pages and the inserted comparison pages. storeHashes(folder, manifest)
+# is called for every manifest which got new hashes.
+def alignFolders(referencePath, referencePages, referenceManifest, comparisonPath, comparisonPages, comparisonManifest, storeHashes=None):
+    refHashes, refComputed = folderHashes(referencePath, referencePages, referenceManifest)
+    compHashes, compComputed = folderHashes(comparisonPath, comparisonPages, comparisonManifest)
+    if storeHashes is not None:
+        if refComputed:
+            storeHashes(referencePath, referenceManifest)
+        if compComputed:
+            storeHashes(comparisonPath, comparisonManifest)
+    pairs = alignPages(refHashes, compHashes)
+    matched = [(referencePages[i], comparisonPages[j]) for i, j in pairs if i is not None and j is not None]
+    removed = [referencePages[i] for i, j in pairs if j is None]
+    inserted = [comparisonPages[j] for i, j in pairs if i is None]
+    return matched, removed, inserted
@@ -8,14 +8,125 @@
 # 
 # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-from subprocess import check_output, Popen, PIPE
+
 import os
+import json
+import shlex
+import hashlib
+import threading
+from subprocess import check_output, CalledProcessError, DEVNULL
+
+from .helpers import ProcessSlots, runCommands, hashPath, readFile, writeFile, toolPath
+
+# daps arguments of each file type
+formatParams = {'pdf': ['pdf'], 'html': ['html'], 'single-html': ['html', '--single'], 'epub': ['epub']}
+
+# daps processes started by all compile threads together
+slots = None
+slotsLock = threading.Lock()
+
+def dapsSlots(count):
+    global slots
+    slotsLock.acquire()
+    if slots is None:
+        slots = ProcessSlots(count)
+    slotsLock.release()
+    return slots
+
+# folders of a testcase which are created by daps or dapscompare
+generatedFolders = ['build', 'dapscompare-reference', 'dapscompare-comparison', 'dapscompare-result']
+
+# file in the build folder which stores the key of the build it contains
+buildCacheFile = ".dapscompare-buildkey"
+
+versionCache = {}
+hashCache = {}
+cacheLock = threading.Lock()
+
+def dapsVersion():
+    cacheLock.acquire()
+    if 'daps' not in versionCache:
+        try:
+            versionCache['daps'] = check_output([toolPath("daps"), "--version"], stderr=DEVNULL).decode('utf-8', 'replace').strip()
+        except (OSError, CalledProcessError):
+            versionCache['daps'] = ""
+    cacheLock.release()
+    return versionCache['daps']
+
+# stylesheet folders are shared by many testcases, hash them only once per run
+def cachedHashPath(path):
+    cacheLock.acquire()
+    if path not in hashCache:
+        hashCache[path] = hashPath(path)
+    cacheLock.release()
+    return hashCache[path]
+
+# configuration files daps reads before the DC file
+dapsConfigFiles = ["/etc/daps/config", "~/.config/daps/dapsrc"]
+
+# stylesheets daps uses when no STYLEROOT is set and which the stylesheets
+# of a STYLEROOT import. An update of a stylesheet package changes them.
+defaultStyleFolders = ["/usr/share/xml/docbook/stylesheet", "/usr/share/daps/daps-xslt"]
+
+# stylesheet folders set in a DC or daps configuration file
+def styleRoots(path):
+    paths = []
+    for line in (readFile(path) or "").splitlines():
+        name, sep, value = line.partition("=")
+        if name.strip() in ['STYLEROOT', 'FALLBACK_STYLEROOT']:
+            paths.append(value.strip().strip('"\''))
+    return paths
+
+# paths outside of the testcase the build depends on: the daps
+# configuration, the default stylesheets, stylesheets set in the
+# configuration or the DC files and paths passed with --daps
+def externalInputs(testcase, dapsParam):
+    paths = [os.path.expanduser(path) for path in dapsConfigFiles] + defaultStyleFolders
+    for path in dapsConfigFiles:
+        paths.extend(styleRoots(os.path.expanduser(path)))
+    for filename in sorted(os.listdir(testcase)):
+        if filename[0:2] == "DC":
+            paths.extend(styleRoots(testcase+filename))
+    for parameter in shlex.split(dapsParam):
+        paths.append(parameter.partition("=")[2] or parameter)
+    return [os.path.realpath(path) for path in paths if os.path.isabs(path) and os.path.exists(path)]
+
+# content hash of everything a build depends on
+def buildKey(testcase, dapsParam, filetypes):
+    key = hashlib.sha1()
+    key.update(json.dumps([dapsVersion(), dapsParam, sorted(filetypes)]).encode('utf-8'))
+    key.update((hashPath(testcase, exclude=generatedFolders) or "").encode('utf-8'))
+    for path in externalInputs(testcase, dapsParam):
+        key.update(path.encode('utf-8'))
+        key.update((cachedHashPath(path) or "").encode('utf-8'))
+    return key.hexdigest()
+
+# status of the existing build if it has the same key, otherwise False
+def readBuildCache(testcase, key):
+    content = readFile(testcase+"build/"+buildCacheFile)
+    if content is False:
+        return False
+    try:
+        content = json.loads(content)
+    except ValueError:
+        return False
+    if content.get('key') != key:
+        return False
+    return content['status']
+
+def writeBuildCache(testcase, key, status):
+    if os.path.isdir(testcase+"build"):
+        writeFile(testcase+"build/"+buildCacheFile, json.dumps({'key': key, 'status': status}, sort_keys=True))
 
 class daps:
-    def __init__(self, testcase, dapsParam, filetypes = []):
+    def __init__(self, testcase, dapsParam, filetypes = [], slots = None):
         self.testcase = testcase
-        self.filetypes = filetypes
+        # status and success only contain file types daps can build
+        self.filetypes = [filetype for filetype in filetypes if filetype in formatParams]
         self.dapsParam = dapsParam
+        if slots is None:
+            slots = ProcessSlots(len(self.filetypes))
+        self.slots = slots
 
         self.createFolders()
 
@@ -23,6 +134,9 @@ class daps:
 
         self.findDcFiles()
 
+        # {DC file: {file type: return code}}
+        self.status = {}
+
         self.success = self.compileAllWait()
 
     def findDcFiles(self):
@@ -37,50 +151,37 @@ class daps:
                 if not os.path.exists(self.testcase+targetfolder):
                     os.makedirs(self.testcase+targetfolder)
 
-    def compilePdf(self):
-        my_env = os.environ.copy()
-        for dcFile in self.dcFiles:
-            self.procDaps = Popen(["cd "+self.testcase+" && /usr/bin/daps "+self.dapsParam+" -d "+dcFile+" pdf"], env=my_env, shell=True, stdout=PIPE, stderr=PIPE)
-            self.procDaps.wait()
-            result = str(self.procDaps.returncode)
-            return result
+    def command(self, dcFile, filetype):
+        return [toolPath("daps")] + shlex.split(self.dapsParam) + ["-d", dcFile] + formatParams[filetype]
 
-    def compileHtml(self):
-        my_env = os.environ.copy()
+    # build every DC file in every file type at the same time. The file
+    # types of one DC file share its profiled sources in the build folder,
+    # so the first file type of a DC file is built before the others.
+    def compileAllWait(self):
+        jobs = []
+        commands = []
+        after = []
         for dcFile in self.dcFiles:
-            self.procHtml = Popen(["cd "+self.testcase+" && /usr/bin/daps "+self.dapsParam+" -d "+dcFile+" html"], env=my_env, shell=True, stdout=PIPE, stderr=PIPE)
-            self.procHtml.wait()
-            result = str(self.procHtml.returncode)
-            return result
+            first = len(commands)
+            for filetype in self.filetypes:
+                jobs.append((dcFile, filetype))
+                commands.append(self.command(dcFile, filetype))
+                if len(commands) - 1 == first:
+                    after.append(None)
+                else:
+                    after.append(first)
 
-    def compileSingleHtml(self):
-        my_env = os.environ.copy()
-        for dcFile in self.dcFiles:
-            self.procHtml = Popen(["cd "+self.testcase+" && /usr/bin/daps "+self.dapsParam+" -d "+dcFile+" html --single"], env=my_env, shell=True, stdout=PIPE, stderr=PIPE)
-            self.procHtml.wait()
-            result = str(self.procHtml.returncode)
-            return result
+        returncodes = runCommands(commands, self.slots, after=after, cwd=self.testcase)
 
-    def compileEpub(self):
-        my_env = os.environ.copy()
         for dcFile in self.dcFiles:
-            self.procEpub = Popen(["cd "+self.testcase+" && /usr/bin/daps "+self.dapsParam+" -d "+dcFile+" epub"], env=my_env, shell=True, stdout=PIPE, stderr=PIPE)
-            self.procEpub.wait()
-            result = str(self.procEpub.returncode)
-            return result
+            self.status[os.path.basename(dcFile)] = {}
+        for (dcFile, filetype), returncode in zip(jobs, returncodes):
+            self.status[os.path.basename(dcFile)][filetype] = returncode
 
-    def compileAllWait(self):
+        # file types which were built for all DC files
         success = []
-        if 'pdf' in self.filetypes:
-            if self.compilePdf() == "0":
-                success.append('pdf')
-        if 'html' in self.filetypes:
-            if self.compileHtml() == "0":
-                success.append('html')
-        if 'single-html' in self.filetypes:
-            if self.compileSingleHtml() == "0":
-                success.append('single-html')
-        if 'epub' in self.filetypes:
-            if self.compileEpub() == "0":
-                success.append('epub')
+        if len(self.dcFiles) > 0:
+            for filetype in self.filetypes:
+                if all([self.status[dcFile][filetype] == 0 for dcFile in self.status]):
+                    success.append(filetype)
         return success
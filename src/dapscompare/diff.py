@@ -0,0 +1,121 @@
+# The MIT License (MIT)
+# 
+# Copyright (c) 2017, Sven Seeberg-Elverfeldt <sseebergelverfeldt@suse.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import json
+
+import numpy as np
+from scipy import ndimage
+
+# 8-connected neighbourhood
+neighbourhood = np.ones((3, 3), dtype=bool)
+
+
+# per-channel tolerance as array, tolerance is a number or a list with one value per channel
+def channelTolerance(tolerance, channels):
+    tolerance = list(np.atleast_1d(tolerance))
+    while len(tolerance) < channels:
+        tolerance.append(tolerance[-1])
+    return np.array(tolerance[:channels], dtype=np.int16)
+
+
+# changes closer than this many pixels are merged into one region
+regionBlockSize = 8
+
+
+# bounding boxes [x0, y0, x1, y1] (x1 and y1 exclusive) of all groups of
+# changed pixels. The mask is reduced to blocks of blockSize pixels first,
+# which keeps the labeling cheap and merges the pixels of a changed word
+# or line into one region.
+def findRegions(mask, blockSize=regionBlockSize):
+    height, width = mask.shape
+    padded = np.zeros((-(-height // blockSize) * blockSize, -(-width // blockSize) * blockSize), dtype=bool)
+    padded[:height, :width] = mask
+    blocks = padded.reshape(padded.shape[0] // blockSize, blockSize, padded.shape[1] // blockSize, blockSize).any(axis=(1, 3))
+    labels, count = ndimage.label(blocks, structure=neighbourhood)
+    regions = []
+    for slices in ndimage.find_objects(labels):
+        regions.append([int(slices[1].start * blockSize), int(slices[0].start * blockSize),
+                        int(min(slices[1].stop * blockSize, width)), int(min(slices[0].stop * blockSize, height))])
+    return regions
+
+
+# compare two decoded images. Returns None if they differ in size,
+# otherwise a dict with the number of changed pixels, the largest
+# difference of a channel and the changed regions, and the mask of
+# changed pixels.
+#
+# A channel counts as changed if it differs by more than tolerance.
+# Differences up to aaThreshold only count next to larger differences,
+# so anti-aliasing and font hinting noise is ignored while the soft
+# edges of a real change are kept.
+def diffImages(imgRef, imgComp, tolerance=0, aaThreshold=0):
+    if imgRef.shape != imgComp.shape:
+        return None
+    # int16 instead of uint8, so negative differences do not wrap around
+    delta = np.abs(imgRef.astype(np.int16) - imgComp.astype(np.int16))
+    if delta.ndim == 2:
+        delta = delta[:, :, np.newaxis]
+    maxDelta = delta.max(axis=2)
+    mask = np.any(delta > channelTolerance(tolerance, delta.shape[2]), axis=2)
+    if aaThreshold > 0:
+        strong = mask & (maxDelta > aaThreshold)
+        near = ndimage.binary_dilation(strong, structure=neighbourhood, iterations=2)
+        mask = strong | (mask & near)
+    changed = int(np.count_nonzero(mask))
+    metrics = {
+        'changed': changed,
+        'maxDelta': int(maxDelta[mask].max()) if changed > 0 else 0,
+        'regions': findRegions(mask) if changed > 0 else [],
+    }
+    return metrics, mask
+
+
+# metrics of two pages which differ in size. There is no diff map, the
+# whole comparison page counts as changed.
+def sizeMetrics(imgRef, imgComp):
+    height, width = imgComp.shape[:2]
+    return {
+        'changed': height * width,
+        'maxDelta': 255,
+        'regions': [],
+        'sizes': [list(imgRef.shape[:2]), [height, width]],
+    }
+
+
+# file extension of diff maps
+diffMapSuffix = ".npz"
+
+
+# store the mask of changed pixels as compressed bit array together with
+# its metrics. A few KB instead of a full size PNG.
+def saveDiffMap(path, mask, metrics):
+    with open(path, 'wb') as f:
+        np.savez_compressed(f, bits=np.packbits(mask), shape=np.array(mask.shape), metrics=np.array(json.dumps(metrics)))
+
+
+def loadDiffMap(path):
+    with np.load(path) as data:
+        shape = tuple(data['shape'])
+        mask = np.unpackbits(data['bits'])[:shape[0] * shape[1]].reshape(shape).astype(bool)
+        metrics = json.loads(str(data['metrics']))
+    return mask, metrics
+
+
+# diff two pages and save the diff map to diffPath if there are any
+# changes. Returns the metrics or None if the pages differ in size.
+def diffAndSave(imgRef, imgComp, diffPath, tolerance=0, aaThreshold=0):
+    result = diffImages(imgRef, imgComp, tolerance, aaThreshold)
+    if result is None:
+        return None
+    metrics, mask = result
+    if metrics['changed'] > 0:
+        saveDiffMap(diffPath, mask, metrics)
+    return metrics
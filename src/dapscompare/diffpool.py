@@ -0,0 +1,118 @@
+# The MIT License (MIT)
+# 
+# Copyright (c) 2017, Sven Seeberg-Elverfeldt <sseebergelverfeldt@suse.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .diff import diffAndSave
+
+
+class SharedPage:
+    # a decoded page copied into a shared memory block, so worker
+    # processes can read it without pickling the array
+    def __init__(self, image):
+        from multiprocessing import shared_memory
+        self.shm = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+        try:
+            array = np.ndarray(image.shape, dtype=image.dtype, buffer=self.shm.buf)
+            array[:] = image
+            del array
+        except BaseException:
+            self.release()
+            raise
+        self.descriptor = (self.shm.name, image.shape, image.dtype.str)
+
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+# runs in the worker process
+def diffSharedPages(refDescriptor, compDescriptor, diffPath, tolerance, aaThreshold):
+    from multiprocessing import shared_memory
+    blocks = []
+    arrays = []
+    for name, shape, dtype in [refDescriptor, compDescriptor]:
+        shm = shared_memory.SharedMemory(name=name)
+        blocks.append(shm)
+        arrays.append(np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf))
+    try:
+        return diffAndSave(arrays[0], arrays[1], diffPath, tolerance, aaThreshold)
+    finally:
+        # views must be gone before the blocks can be closed
+        del arrays
+        for shm in blocks:
+            shm.close()
+
+
+class DiffJob:
+    def __init__(self, future, pages):
+        self.future = future
+        self.pages = pages
+
+    # metrics of diffAndSave, frees the shared memory
+    def result(self):
+        try:
+            return self.future.result()
+        finally:
+            for page in self.pages:
+                page.release()
+
+
+class DiffExecutor:
+    # process pool which diffs pages for all diff threads
+    def __init__(self):
+        self.pool = None
+        self.lock = threading.Lock()
+
+    # False if shared memory is not supported (Python < 3.8)
+    def available(self):
+        try:
+            from multiprocessing import shared_memory
+        except ImportError:
+            return False
+        return True
+
+    def start(self, workers):
+        self.lock.acquire()
+        if self.pool is None and workers > 0 and self.available():
+            # forking a process with running Qt threads is not safe
+            self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        self.lock.release()
+
+    def running(self):
+        return self.pool is not None
+
+    def submit(self, imgRef, imgComp, diffPath, tolerance=0, aaThreshold=0):
+        pages = []
+        try:
+            pages.append(SharedPage(imgRef))
+            pages.append(SharedPage(imgComp))
+            future = self.pool.submit(diffSharedPages, pages[0].descriptor, pages[1].descriptor, diffPath, tolerance, aaThreshold)
+        except BaseException:
+            # without a job nobody else frees the blocks
+            for page in pages:
+                page.release()
+            raise
+        return DiffJob(future, pages)
+
+    def stop(self):
+        self.lock.acquire()
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        self.lock.release()
+
+
+diffExecutor = DiffExecutor()
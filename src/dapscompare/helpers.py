@@ -15,10 +15,12 @@ import queue
 import sys
 import json
 import shutil
+import glob
+import re
+import time
+from subprocess import Popen, DEVNULL
 
-from scipy.misc import imsave, imread
-import numpy as np
-from PyQt5 import QtGui, QtCore
+from scipy.misc import imread
 
 def readFile(filePath):
     if(os.path.isfile(filePath)):
@@ -43,27 +45,38 @@ def modeToName(mode):
         return "dapscompare-comparison"
 
 
-def hashPath(path):
-    import hashlib, os
+# sha1 of a file or of all files in a folder. Names listed in exclude
+# are skipped, wherever they appear in the tree.
+def hashPath(path, exclude=[]):
+    import hashlib
     SHAhash = hashlib.sha1()
     if not os.path.exists (path):
         return False
     if os.path.isfile(path):
         readFileBlock(path,SHAhash)
     else:
-        for root, dirs, files in os.walk(path):
-            for names in files:
+        for root, dirs, files in os.walk(path, followlinks=True):
+            # walk in a fixed order, otherwise the hash changes between runs
+            dirs[:] = sorted([name for name in dirs if name not in exclude])
+            for names in sorted(files):
+                if names in exclude:
+                    continue
                 filepath = os.path.join(root,names)
-                readFileBlock(filepath,SHAhash)
+                SHAhash.update(os.path.relpath(filepath, path).encode('utf-8'))
+                if os.path.isfile(filepath):
+                    readFileBlock(filepath,SHAhash)
+                else:
+                    # broken symlink
+                    SHAhash.update(os.readlink(filepath).encode('utf-8'))
     return SHAhash.hexdigest()
 
 
 def readFileBlock(filepath,SHAhash):
     with open(filepath, 'rb') as f1:
         while True:
-            buf = f1.read(4096)
+            buf = f1.read(65536)
             if not buf : break
-            SHAhash.update(hashlib.sha1(buf).hexdigest())
+            SHAhash.update(buf)
 
 
 def registerHash(params,dataCollection):
@@ -72,116 +85,422 @@ def registerHash(params,dataCollection):
     hashstring = json.dumps(params, sort_keys=True)
     md5 = hashlib.md5(hashstring.encode('utf-8'))
     # add md5sum and string to config and save to file in the end
-    dataCollection.lock.acquire()
-    dataCollection.depHashes[md5.hexdigest()] = params
-    dataCollection.lock.release()
+    dataCollection.addDepHash(md5.hexdigest(), params)
     result = md5.hexdigest()
     #print(hashstring + " " + result)
     return result
 
 
+# every folder of rendered pages has a manifest next to it, i.e.
+# dapscompare-reference/<md5>.json for dapscompare-reference/<md5>/
+def manifestPath(folder):
+    return folder.rstrip("/")+".json"
+
+
+def readManifest(folder):
+    content = readFile(manifestPath(folder))
+    if content is False:
+        return {}
+    try:
+        return json.loads(content)
+    except ValueError:
+        return {}
+
+
+def writeManifest(folder, manifest):
+    writeFile(manifestPath(folder), json.dumps(manifest, sort_keys=True))
+
+
+# uncompressed pages of a folder, see pagestore.py
+def pageStorePath(folder):
+    return folder.rstrip("/")+".pages"
+
+
+def removeManifest(folder):
+    if os.path.exists(manifestPath(folder)):
+        os.remove(manifestPath(folder))
+
+
+# sha1 of every page in a folder
+def pageDigests(folder):
+    digests = {}
+    for filename in listFiles(folder):
+        digests[filename] = hashPath(os.path.join(folder, filename))
+    return digests
+
+
+# copies of the PDF files the pages of a reference folder were rendered
+# from, so changed pages can be rendered again at a higher resolution
+def sourcesPath(folder):
+    return folder.rstrip("/")+".sources"
+
+
+# remove all rendered pages of a folder, so no pages of an older and
+# longer document are left over
+def clearFolder(folder):
+    removeManifest(folder)
+    if os.path.exists(pageStorePath(folder)):
+        os.remove(pageStorePath(folder))
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    for item in listFiles(folder):
+        os.remove(os.path.join(folder, item))
+
+
+# make the comparison page the new reference page
+def acceptPage(comparisonPath, referencePath):
+    from .objects import relink
+    try:
+        relink(comparisonPath, referencePath)
+    except OSError:
+        replaceFile(comparisonPath, referencePath)
+    # the reference images no longer match the file they were rendered from
+    removeManifest(os.path.dirname(referencePath))
+
+
+# hardlink a file, copy it if that is not possible
+def linkFile(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        replaceFile(source, target)
+
+
+# pages may be hardlinked into the render cache and other folders. Never
+# write through such a link, copy to a new file and rename it over the target.
+def replaceFile(source, target):
+    temp = target+".%d.tmp" % threading.get_ident()
+    try:
+        shutil.copyfile(source, temp)
+        os.replace(temp, target)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+
+
+def cacheFolder(cfg, *names):
+    return os.path.join(cfg.directory, cfg.cacheFolder, *names)
+
+
 def listFiles(folder):
     result = []
     #print("Listing "+folder)
     for item in os.listdir(folder):
-        if os.path.isfile(folder+item):
+        if os.path.isfile(os.path.join(folder, item)):
             result.append(item)
     return result
 
 
-class myWorkThread (QtCore.QThread):
-    # worker threads which compile the DC files and compare the results
-    def __init__(self, cfg, dataCollection, folders, foldersLock, threadID, name, counter):
-        QtCore.QThread.__init__(self)
-        self.threadID = threadID
-        self.name = name
-        self.counter = counter
-        self.cfg = cfg
-        self.dataCollection = dataCollection
-        self.folders = folders
-        self.foldersLock = foldersLock
-
-    def __del__(self):
-        self.wait()
-
-    def run(self):
-        from .daps import daps
-        # we want the threads to keep running until the queue of test cases is empty
-        while True:
-            testcase = ""
-            self.foldersLock.acquire()
-            if(self.folders.empty() == False):
-                testcase = self.folders.get()
-            self.foldersLock.release()
-            # finish the thread if queue is empty
-            if(testcase == ""):
-                break
-            if self.cfg.silent == False: print(self.name+" now working on "+testcase)
-
-            cleanDirectories(self.cfg, testcaseSubfolders=['build'], rmConfigs=False, testcase=testcase)
-
-            # compile DC files
-            myDaps = daps(testcase, self.cfg.dapsParam, self.cfg.filetypes)
-            for filetype in self.cfg.filetypes:
-                if filetype not in myDaps.success:
-                    if self.cfg.silent == False: print(testcase + " failed to build " + filetype)
-
-            # render results to images
-            runRenderers(self.cfg, self.dataCollection, testcase)
-
-            if(self.cfg.mode == 2):
-                runTests(self.cfg, self.dataCollection, testcase)
-        if self.cfg.silent == False: print(self.name+" finished")
+# cores this process may run on
+def availableCpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
+
+class ProcessSlots:
+    # limits the number of external processes all worker threads start together
+    def __init__(self, count):
+        self.count = count
+        self.used = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, blocking=True):
+        self.condition.acquire()
+        while self.used >= self.count:
+            if not blocking:
+                self.condition.release()
+                return False
+            self.condition.wait()
+        self.used = self.used + 1
+        self.condition.release()
+        return True
+
+    def release(self):
+        self.condition.acquire()
+        self.used = self.used - 1
+        self.condition.notify()
+        self.condition.release()
+
+    def free(self):
+        return max(self.count - self.used, 0)
+
+
+# folder of daps, convert and gs, see --tools
+defaultToolsFolder = "/usr/bin"
+toolsFolder = defaultToolsFolder
+
+def toolPath(name):
+    return os.path.join(toolsFolder, name)
+
+
+# Popen.poll, but also returns the resource usage of the finished
+# process and the processes it waited for, see runlog.py
+def pollProcess(process, blocking=False):
+    try:
+        pid, status, usage = os.wait4(process.pid, 0 if blocking else os.WNOHANG)
+    except ChildProcessError:
+        return process.poll(), None
+    if pid == 0:
+        return None, None
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    return process.returncode, usage
+
+
+# run a list of commands concurrently, as many at once as slots allows,
+# and return their return codes in the same order. If after[n] is set,
+# command n starts only when command after[n] has finished.
+def runCommands(commands, slots, after=None, cwd=None):
+    if after is None:
+        after = [None] * len(commands)
+    returncodes = [None] * len(commands)
+    pending = list(range(0, len(commands)))
+    running = {}
+    # (program, start, end, resource usage, command line) of every process, see runlog.py
+    processes = []
+    started = {}
+    my_env = os.environ.copy()
+    while len(pending) > 0 or len(running) > 0:
+        ready = [n for n in pending if after[n] is None or returncodes[after[n]] is not None]
+        # only block for a slot if nothing of our own is running
+        while len(ready) > 0 and slots.acquire(blocking=(len(running) == 0)):
+            n = ready.pop(0)
+            pending.remove(n)
+            running[n] = Popen(commands[n], env=my_env, cwd=cwd, stdout=DEVNULL, stderr=DEVNULL)
+            started[n] = time.time()
+        for n, process in list(running.items()):
+            returncode, usage = pollProcess(process)
+            if returncode is not None:
+                returncodes[n] = returncode
+                processes.append((os.path.basename(commands[n][0]), started[n], time.time(), usage, " ".join(commands[n])))
+                del running[n]
+                slots.release()
+        if len(running) > 0:
+            time.sleep(0.05)
+    from .runlog import recordProcesses
+    recordProcesses(processes)
+    return returncodes
+
+
+# compile all DC files of a testcase, first stage of the pipeline
+def compileTestcase(cfg, dataCollection, testcase):
+    from .daps import daps, dapsSlots, buildKey, readBuildCache, writeBuildCache, formatParams
+    # file types daps cannot build are ignored
+    filetypes = [filetype for filetype in cfg.filetypes if filetype in formatParams]
+    key = False
+    if cfg.buildCache:
+        key = buildKey(testcase, cfg.dapsParam, filetypes)
+        status = readBuildCache(testcase, key)
+        if status is not False:
+            if cfg.silent == False: print("Build of "+testcase+" is up to date")
+            dataCollection.addBuildStatus(testcase, status, cached=True)
+            return
+
+    if cfg.silent == False: print("Compiling "+testcase)
+
+    cleanDirectories(cfg, testcaseSubfolders=['build'], rmConfigs=False, testcase=testcase)
+
+    # compile DC files
+    myDaps = daps(testcase, cfg.dapsParam, filetypes, dapsSlots(cfg.dapsJobs))
+    dataCollection.addBuildStatus(testcase, myDaps.status)
+    for dcFile in sorted(myDaps.status):
+        for filetype in filetypes:
+            if myDaps.status[dcFile][filetype] != 0:
+                if cfg.silent == False: print(testcase + dcFile + " failed to build " + filetype)
+
+    # only complete builds can be reused
+    if key is not False and len(myDaps.success) == len(filetypes):
+        writeBuildCache(testcase, key, myDaps.status)
+    from .runlog import addOutput
+    addOutput(size=folderSize(testcase+"build"))
+
+
+def folderSize(folder):
+    size = 0
+    for root, dirs, files in os.walk(folder):
+        for filename in files:
+            size = size + os.path.getsize(os.path.join(root, filename))
+    return size
+
+
+# render results to images, second stage of the pipeline
+def renderTestcase(cfg, dataCollection, testcase):
+    if cfg.silent == False: print("Rendering "+testcase)
+    runRenderers(cfg, dataCollection, testcase)
+
+
+# compare with reference images, last stage of the pipeline in compare mode
+def diffTestcase(cfg, dataCollection, testcase):
+    if cfg.silent == False: print("Comparing "+testcase)
+    runTests(cfg, dataCollection, testcase)
 
 
 # prepare for file types and then call the appropriate rendering modules
 def runRenderers(cfg, dataCollection, testcase):
-    from .renderers import pdfItems, renderPdf, htmlItems, singleHtmlItems, epubItems, renderHtml
+    from .renderers import pdfItems, htmlItems, singleHtmlItems, epubItems, renderCached
+    renderItems = {'pdf': pdfItems, 'html': htmlItems, 'single-html': singleHtmlItems, 'epub': epubItems}
     for filetype in cfg.filetypes:
-        if filetype == 'pdf':
-            for renderItem in pdfItems(testcase, cfg, dataCollection):
-                renderPdf(renderItem[0], renderItem[1], renderItem[2])
-        elif filetype == 'html' and cfg.noGui is False:
-            for renderItem in htmlItems(testcase, cfg, dataCollection):
-                renderHtml(renderItem[0], renderItem[1], renderItem[2])
-        elif filetype == 'single-html' and cfg.noGui is False:
-            for renderItem in singleHtmlItems(testcase, cfg, dataCollection):
-                renderHtml(renderItem[0], renderItem[1], renderItem[2])
-        elif filetype == 'epub' and cfg.noGui is False:
-            for renderItem in epubItems(testcase, cfg, dataCollection):
-                renderHtml(renderItem[0], renderItem[1], renderItem[2])
+        if filetype not in renderItems or (filetype != 'pdf' and cfg.noGui is True):
+            continue
+        renderCached(cfg, filetype, list(renderItems[filetype](testcase, cfg, dataCollection)))
 
 
 # diff images of reference and compare run and save result
 def runTests(cfg, dataCollection, testcase):
-    for md5, description in dataCollection.depHashes.items():
+    from .diff import diffAndSave, diffMapSuffix, sizeMetrics
+    from .diffpool import diffExecutor
+    from .align import pageSortKey, alignFolders
+    from .renderers import storePageHashes
+    from .runlog import step, addOutput
+    # other testcases register hashes while this one is compared
+    dataCollection.lock.acquire()
+    depHashes = list(dataCollection.depHashes.items())
+    dataCollection.lock.release()
+    for md5, description in depHashes:
         if not description['testcase'] == testcase:
             continue
         referencePath = testcase+"dapscompare-reference/"+md5+"/"
         comparisonPath = testcase+"dapscompare-comparison/"+md5+"/"
-        numRefImgs = len(listFiles(referencePath))
-        numComImgs = len(listFiles(comparisonPath))
-        if (numRefImgs - numComImgs) != 0 and numRefImgs != 0:
-            dataCollection.addDiffNumPages([referencePath, numRefImgs, numComImgs])
-            continue
-        cleanDirectories(cfg, testcaseSubfolders=['dapscompare-comparison', 'dapscompare-result'], rmConfigs=False, keepDirs=True, testcase=testcase)
         if not os.path.exists(referencePath):
-            if cfg.silent == False: print("No reference images for "+dataCollection.depHashes[md5])
+            if cfg.silent == False: print("No reference images for "+str(description))
+            continue
+        referenceManifest = readManifest(referencePath)
+        comparisonManifest = readManifest(comparisonPath)
+        # the same file was rendered with the same parameters for the reference
+        artifact = comparisonManifest.get('artifact')
+        if cfg.renderCache and artifact is not None and artifact == referenceManifest.get('artifact'):
             continue
+        referencePages = sorted(listFiles(referencePath), key=pageSortKey)
+        comparisonPages = []
+        if os.path.exists(comparisonPath):
+            comparisonPages = sorted(listFiles(comparisonPath), key=pageSortKey)
+        numRefImgs = len(referencePages)
+        numComImgs = len(comparisonPages)
+        if numRefImgs == 0:
+            continue
+        if numRefImgs == numComImgs:
+            pairs = list(zip(referencePages, comparisonPages))
+        else:
+            # find inserted and removed pages, compare the others
+            pairs, removed, inserted = alignFolders(referencePath, referencePages, referenceManifest, comparisonPath, comparisonPages, comparisonManifest,
+                                                    lambda folder, manifest: storePageHashes(cfg, folder, manifest))
+            dataCollection.addDiffNumPages([referencePath, numRefImgs, numComImgs, {'removed': removed, 'inserted': inserted}])
+        cleanDirectories(cfg, testcaseSubfolders=['dapscompare-comparison', 'dapscompare-result'], rmConfigs=False, keepDirs=True, testcase=testcase)
         diffFolder = testcase+"dapscompare-result/"+md5+"/"
         if not os.path.exists(diffFolder):
             os.makedirs(diffFolder)
 
-        for filename in os.listdir(referencePath):
-            imgRef = imread(referencePath+filename)
-            imgComp = imread(comparisonPath+filename)
-            try:
-                imgDiff = imgRef - imgComp
-                if np.count_nonzero(imgDiff) > 0:
-                    imsave(diffFolder+filename, imgDiff)
-                    dataCollection.addImgDiffs([referencePath+filename, comparisonPath+filename, diffFolder+filename])
-            except:
-                dataCollection.addDiffNumPages([referencePath, numRefImgs, numComImgs])
+        referenceDigests = referenceManifest.get('pages', {})
+        comparisonDigests = comparisonManifest.get('pages', {})
+        referenceStore = None
+        if cfg.refStore:
+            from .pagestore import openPageStore
+            referenceStore = openPageStore(referencePath)
+        # changed PDF pages are rendered again before they are reported
+        refine = None
+        if cfg.pdfRefine > cfg.pdfDensity and description.get('Type') == 'pdf':
+            refine = []
+        # pages handed to the diff processes and not collected yet
+        pending = []
+        try:
+            for referencePage, comparisonPage in pairs:
+                # identical files need not be decoded
+                if cfg.hashCheck:
+                    referenceDigest = referenceDigests.get(referencePage) or hashPath(referencePath+referencePage)
+                    comparisonDigest = comparisonDigests.get(comparisonPage) or hashPath(comparisonPath+comparisonPage)
+                    if referenceDigest == comparisonDigest:
+                        continue
+                addOutput(pages=1)
+                with step('imread'):
+                    imgRef = None
+                    if referenceStore is not None:
+                        imgRef = referenceStore.get(referencePage)
+                    if imgRef is None:
+                        imgRef = imread(referencePath+referencePage)
+                    imgComp = imread(comparisonPath+comparisonPage)
+                entry = [referencePath+referencePage, comparisonPath+comparisonPage, diffFolder+comparisonPage+diffMapSuffix]
+                # a page of another size is one changed page, the page count is the same
+                if imgRef.shape != imgComp.shape:
+                    addDiffResult(dataCollection, entry, sizeMetrics(imgRef, imgComp), refine)
+                    continue
+                if diffExecutor.running():
+                    pending.append((entry, diffExecutor.submit(imgRef, imgComp, entry[2], cfg.tolerance, cfg.aaThreshold)))
+                    # limit the shared memory one thread holds
+                    if len(pending) >= 4:
+                        entry, job = pending.pop(0)
+                        with step('diff'):
+                            metrics = job.result()
+                        addDiffResult(dataCollection, entry, metrics, refine)
+                else:
+                    with step('diff'):
+                        metrics = diffAndSave(imgRef, imgComp, entry[2], cfg.tolerance, cfg.aaThreshold)
+                    addDiffResult(dataCollection, entry, metrics, refine)
+            with step('diff'):
+                while len(pending) > 0:
+                    entry, job = pending.pop(0)
+                    addDiffResult(dataCollection, entry, job.result(), refine)
+        finally:
+            # after an error the remaining jobs still have to free their shared memory
+            for entry, job in pending:
+                try:
+                    job.result()
+                except Exception:
+                    pass
+        if refine:
+            with step('refine'):
+                refined = refineTestcase(cfg, testcase, referencePath, diffFolder, refine)
+            for entry in refined:
+                dataCollection.addImgDiffs(entry)
+
+
+# render the changed pages of a PDF again at cfg.pdfRefine and compare
+# them again. The entries point to the high resolution images; the pages
+# they replace are kept in metrics['source'].
+def refineTestcase(cfg, testcase, referencePath, diffFolder, entries):
+    from .diff import diffAndSave, diffMapSuffix
+    from .renderers import renderPdfPages
+    referenceSources = sorted(glob.glob(sourcesPath(referencePath)+"/*.pdf"))
+    comparisonSources = sorted(glob.glob(testcase+"build/*/*.pdf"))
+    if len(referenceSources) == 0 or len(comparisonSources) == 0:
+        if cfg.silent == False: print("No PDF files to refine "+referencePath)
+        return entries
+    hiresFolder = diffFolder+"hires/"
+    referenceFolder = hiresFolder+"reference/"
+    comparisonFolder = hiresFolder+"comparison/"
+    clearFolder(referenceFolder)
+    clearFolder(comparisonFolder)
+    renderPdfPages(cfg, referenceSources, [pageNumber(entry[0]) for entry in entries], cfg.pdfRefine, referenceFolder)
+    renderPdfPages(cfg, comparisonSources, [pageNumber(entry[1]) for entry in entries], cfg.pdfRefine, comparisonFolder)
+    result = []
+    for entry in entries:
+        refined = [referenceFolder+os.path.basename(entry[0]), comparisonFolder+os.path.basename(entry[1])]
+        refined.append(hiresFolder+os.path.basename(entry[1])+diffMapSuffix)
+        metrics = None
+        if os.path.exists(refined[0]) and os.path.exists(refined[1]):
+            metrics = diffAndSave(imread(refined[0]), imread(refined[1]), refined[2], cfg.tolerance, cfg.aaThreshold)
+        # keep the first pass if the pages could not be rendered again
+        if metrics is None or metrics['changed'] == 0:
+            result.append(entry)
+            continue
+        metrics['source'] = entry[:3]
+        result.append(refined + [metrics])
+    return result
+
+
+# page-012.png is page 12 of the rendered PDF files
+def pageNumber(filename):
+    return int(re.search(r"(\d+)\.[a-z]+$", filename).group(1))
+
+
+def addDiffResult(dataCollection, entry, metrics, changed=None):
+    if metrics['changed'] > 0 and changed is not None:
+        changed.append(entry + [metrics])
+    elif metrics['changed'] > 0:
+        dataCollection.addImgDiffs(entry + [metrics])
 
 
 class MyConfig:
@@ -191,9 +510,15 @@ class MyConfig:
 
         self.cmdParams()
 
+        # external programs are started from cfg.tools
+        global toolsFolder
+        toolsFolder = self.tools
+
         if self.loadConfigBool:
             self.loadConfig()
 
+        self.checkBackends()
+
     def cmdParams(self):
         # first read CLI parameters
         for parameter in sys.argv:
@@ -205,6 +530,8 @@ class MyConfig:
                 self.mode = 3
             elif parameter == "clean":
                 self.mode = 4
+            elif parameter == "stats":
+                self.mode = 5
             elif parameter == "--help":
                 from dapscompare import __file__ as dapscomparedir
                 f = open(os.path.join(os.path.dirname(os.path.realpath(dapscomparedir)), 'README'), 'r')
@@ -213,6 +540,32 @@ class MyConfig:
                 sys.exit()
             elif parameter == "--no-gui":
                 self.noGui = True
+            elif parameter.startswith("--compile-threads="):
+                self.compileThreads = int(parameter[18:])
+            elif parameter.startswith("--render-threads="):
+                self.renderThreads = int(parameter[17:])
+            elif parameter.startswith("--diff-threads="):
+                self.diffThreads = int(parameter[15:])
+            elif parameter == "--no-build-cache":
+                self.buildCache = False
+            elif parameter == "--no-render-cache":
+                self.renderCache = False
+            elif parameter.startswith("--render-cache-size="):
+                self.renderCacheSize = int(parameter[20:])
+            elif parameter.startswith("--tolerance="):
+                self.tolerance = [int(value) for value in parameter[12:].split(",")]
+            elif parameter.startswith("--aa-threshold="):
+                self.aaThreshold = int(parameter[15:])
+            elif parameter == "--ref-store":
+                self.refStore = True
+            elif parameter == "--no-hash-check":
+                self.hashCheck = False
+            elif parameter == "--no-dedupe":
+                self.dedupe = False
+            elif parameter.startswith("--daps-jobs="):
+                self.dapsJobs = int(parameter[12:])
+            elif parameter.startswith("--diff-workers="):
+                self.diffWorkers = int(parameter[15:])
             elif parameter.startswith("--daps="):
                 self.dapsParam = parameter[7:]
             elif parameter.startswith("--testcases="):
@@ -221,6 +574,37 @@ class MyConfig:
                 self.filetypes = parameter[12:].split(",")
             elif parameter.startswith("--html-width="):
                 self.htmlWidth = parameter[13:].split(",")
+            elif parameter == "--no-pdf-parallel":
+                self.pdfParallel = False
+            elif parameter.startswith("--pdf-chunk="):
+                self.pdfChunk = int(parameter[12:])
+            elif parameter.startswith("--pdf-density="):
+                self.pdfDensity = int(parameter[14:])
+            elif parameter.startswith("--pdf-refine="):
+                self.pdfRefine = int(parameter[13:])
+            elif parameter.startswith("--pdf-backend="):
+                self.pdfBackend = parameter[14:]
+            elif parameter.startswith("--html-backend="):
+                self.htmlBackend = parameter[15:]
+            elif parameter.startswith("--html-format="):
+                self.htmlFormat = parameter[14:]
+                if self.htmlFormat not in ("png", "ppm"):
+                    print("Unknown HTML format "+self.htmlFormat+", use png or ppm")
+                    sys.exit(1)
+            elif parameter.startswith("--html-compression="):
+                self.htmlCompression = int(parameter[19:])
+            elif parameter.startswith("--viewer-cache="):
+                self.viewerCache = int(parameter[15:])
+            elif parameter.startswith("--runs="):
+                self.statsRuns = int(parameter[7:])
+            elif parameter.startswith("--tools="):
+                self.tools = os.path.abspath(parameter[8:])
+            elif parameter == "--profile":
+                self.profile = True
+            elif parameter == "--no-history":
+                self.history = False
+            elif parameter.startswith("--memory-reserve="):
+                self.memoryReserve = int(parameter[17:])
             elif parameter == "--ignore-conf":
                 self.loadConfigBool = False
             elif parameter == "--json":
@@ -230,6 +614,12 @@ class MyConfig:
     def stdValues(self):
         self.resDiffFile = "dapscompare-diff.json"
         self.resHashFile = "dapscompare-hash.json"
+        self.historyFile = "dapscompare-history.json"
+        self.runLogFile = "dapscompare-runs.jsonl"
+        self.journalFile = "dapscompare-journal.jsonl"
+        # .txt and .folded are appended
+        self.profileFile = "dapscompare-profile"
+        self.cacheFolder = ".dapscompare-cache"
 
         # set standard values for all other needed parameters
         self.directory = os.getcwd()+"/"
@@ -238,6 +628,7 @@ class MyConfig:
         # 2 = build comparison and run tests (standard)
         # 3 = view results of last run
         # 4 = clean
+        # 5 = print statistics of the last runs
         self.mode = 0
 
         # usually show GUI after comparison
@@ -253,13 +644,93 @@ class MyConfig:
 
         self.htmlWidth = [1280]
 
+        # imagemagick = convert processes, mupdf = PyMuPDF inside dapscompare
+        self.pdfBackend = "imagemagick"
+
+        # split PDFs into page ranges which are rendered at the same time,
+        # pdfChunk pages per range, 0 = split by the number of free cores
+        self.pdfParallel = True
+        self.pdfChunk = 0
+
+        # resolution of rendered PDF pages. Changed pages are rendered and
+        # compared again at pdfRefine, 0 = no second pass
+        self.pdfDensity = 110
+        self.pdfRefine = 0
+
+        # order testcases by their duration in earlier runs and only start
+        # one if the memory it needed is free, keeping memoryReserve MB
+        self.history = True
+        self.memoryReserve = 512
+
+        # number of runs the stats command summarizes
+        self.statsRuns = 10
+
+        # profile the worker threads, see profiling.py
+        self.profile = False
+
+        # folder with daps, convert and gs
+        self.tools = defaultToolsFolder
+
+        # server = keep html2png processes running, process = one process per page
+        self.htmlBackend = "server"
+
+        # image format of rendered HTML pages: png (zlib level htmlCompression) or ppm (uncompressed)
+        self.htmlFormat = "png"
+        self.htmlCompression = 9
+
         self.dapsParam = "--force"
 
+        # reuse the build folder if sources, daps and its parameters did not change
+        self.buildCache = True
+
+        # reuse rendered pages of identical PDF and HTML files. After a run
+        # the least recently used pages are removed down to renderCacheSize MB
+        self.renderCache = True
+        self.renderCacheSize = 2048
+
+        # channel differences up to tolerance are ignored, differences up to
+        # aaThreshold only count next to larger ones (anti-aliasing)
+        self.tolerance = [0]
+        self.aaThreshold = 0
+
+        # keep decoded reference pages in one memory mapped file per folder
+        self.refStore = False
+
+        # compare checksums of pages before decoding them
+        self.hashCheck = True
+
+        # store identical pages only once, as hardlinks
+        self.dedupe = True
+
+        # daps processes running at the same time in all compile threads
+        self.dapsJobs = availableCpus()
+
+        # worker threads of the compile, render and diff stages
+        cpus = multiprocessing.cpu_count()
+        self.compileThreads = cpus
+        self.renderThreads = cpus
+        self.diffThreads = max(cpus // 2, 1)
+
+        # processes which subtract pages for the diff threads, 0 = diff in the threads
+        self.diffWorkers = availableCpus()
+
         self.loadConfigBool = True
 
         self.silent = False
         self.returnJSON = False
 
+        # memory for prepared images in the viewer, in MB
+        self.viewerCache = 256
+
+    def checkBackends(self):
+        from .renderers import pdfBackends, htmlBackends
+        if self.pdfBackend not in pdfBackends or not pdfBackends[self.pdfBackend].available():
+            if self.silent == False: print("PDF backend "+self.pdfBackend+" is not available, using imagemagick")
+            self.pdfBackend = "imagemagick"
+        if self.htmlBackend not in htmlBackends:
+            if self.silent == False: print("HTML backend "+self.htmlBackend+" is not available, using server")
+            self.htmlBackend = "server"
+
     def loadConfig(self):
         content = readFile(self.directory+"/"+self.resHashFile)
         if content:
@@ -281,15 +752,19 @@ class DataCollector:
         # if reference and comparison differ in number of pictures, store this here
         self.diffNumPages = []
 
-        # compare or reference mode, new empty diff list
-        self.imgDiffs = []
-        # view mode, load existing diff list
-        if cfg.mode == 3:
-            imagesList = readFile(cfg.directory+cfg.resDiffFile)
-            if imagesList is False:
-                if cfg.silent == False: print("Nothing to do.")
-                sys.exit()
-            self.imgDiffs, self.diffNumPages = json.loads(imagesList)
+        # return codes of daps for every testcase, DC file and file type
+        self.buildStatus = {}
+        # testcases whose build folder was up to date
+        self.cachedBuilds = []
+
+        # results are written to the journal as they come in, see journal.py
+        from .journal import Journal, readJournal, journalState, replay, recover
+        if cfg.mode in [1, 2, 3]:
+            recover(cfg)
+        self.journal = None
+        # view mode, size of the journal of a running comparison read so far
+        self.following = False
+        self.journalOffset = 0
 
         # hashes of dependencies like image width and filetype
         self.depHashes = {}
@@ -297,52 +772,161 @@ class DataCollector:
         if (fileContent is not False and len(fileContent) > 2):
             self.depHashes = json.loads(fileContent)
 
+        # compare or reference mode, new empty diff list
+        self.imgDiffs = []
+        # view mode, load existing diff list or the results of the running comparison
+        if cfg.mode == 3:
+            records, offset = readJournal(cfg.directory+cfg.journalFile)
+            if journalState(records) == "running" and records[0]['mode'] == 2:
+                replay(records, self)
+                self.following = True
+                self.journalOffset = offset
+            else:
+                imagesList = readFile(cfg.directory+cfg.resDiffFile)
+                if imagesList is False:
+                    if cfg.silent == False: print("Nothing to do.")
+                    sys.exit()
+                self.imgDiffs, self.diffNumPages = json.loads(imagesList)
+
+        if cfg.mode in [1, 2]:
+            self.journal = Journal(cfg.directory+cfg.journalFile)
+            self.journal.start(cfg.mode)
+
 
     def addDiffNumPages(self, item):
         self.lock.acquire()
         self.diffNumPages.append(item)
         self.lock.release()
+        if self.journal is not None:
+            self.journal.append({'kind': 'pages', 'item': item})
+
+
+    def addDepHash(self, md5, params):
+        self.lock.acquire()
+        new = self.depHashes.get(md5) != params
+        self.depHashes[md5] = params
+        self.lock.release()
+        if new and self.journal is not None:
+            self.journal.append({'kind': 'hash', 'md5': md5, 'params': params})
+
+
+    # status is {DC file: {file type: daps return code}}
+    def addBuildStatus(self, testcase, status, cached=False):
+        self.lock.acquire()
+        self.buildStatus[testcase] = status
+        if cached:
+            self.cachedBuilds.append(testcase)
+        self.lock.release()
 
 
     def addImgDiffs(self, item):
         self.lock.acquire()
         self.imgDiffs.append(item)
         self.lock.release()
+        if self.journal is not None:
+            self.journal.append({'kind': 'diff', 'item': item})
 
 def spawnWorkerThreads(cfg, dataCollection):
-    # get number of available cpus.
-    # we want to compile as many test cases with daps at the same time
-    # as we can
+    # compiling, rendering and comparing run in a pipeline. Each step has
+    # its own threads, so one testcase can be rendered while the next one
+    # is compiled.
+    from .pipeline import Pipeline
 
     if cfg.silent == False: print("\n=== Parameters ===\n")
 
     cpus = multiprocessing.cpu_count()
-    #cpus = 1
     if cfg.silent == False: print("Number of CPUs: "+str(cpus))
     if cfg.silent == False: print("Working Directory: "+cfg.directory)
     if cfg.silent == False: print("Building: "+str(cfg.filetypes))
 
-    threads = []
-
     folders, foldersLock = queueTestcases(cfg)
+    testcases = []
+    while not folders.empty():
+        testcases.append(folders.get())
 
-    if folders.qsize() < cpus:
-        cpus = folders.qsize()
+    # no stage needs more threads than there are testcases
+    stages = [('compile', compileTestcase, cfg.compileThreads), ('render', renderTestcase, cfg.renderThreads)]
+    if cfg.mode == 2:
+        stages.append(('diff', diffTestcase, cfg.diffThreads))
+    stages = [(name, bindStage(function, cfg, dataCollection), max(min(workers, len(testcases)), 1)) for name, function, workers in stages]
 
-    if cfg.silent == False: print("\n=== Creating "+str(cpus)+" Threads ===\n")
+    if cfg.silent == False: print("\n=== Starting Pipeline: "+", ".join([name+" "+str(workers) for name, function, workers in stages])+" Threads ===\n")
 
-    for threadX in range(0, cpus):
-        thread = myWorkThread(cfg, dataCollection, folders, foldersLock, threadX, "Thread-"+str(threadX), threadX)
-        thread.start()
-        threads.append(thread)
+    from .renderers import activeRenderers
+    renderers = activeRenderers(cfg)
+    for renderer in renderers:
+        renderer.start(cfg)
 
-    # Wait for all threads to complete
-    for t in threads:
-        t.wait()
-    if cfg.silent == False: print("All threads finished.")
     if cfg.mode == 2:
-        writeFile(cfg.directory+cfg.resDiffFile, json.dumps([dataCollection.imgDiffs, dataCollection.diffNumPages], sort_keys=True))
-    writeFile(cfg.directory+cfg.resHashFile, json.dumps(dataCollection.depHashes, sort_keys=True))
+        from .diffpool import diffExecutor
+        diffExecutor.start(cfg.diffWorkers)
+
+    # the longest testcases first, so they do not decide the duration at the end
+    scheduler = None
+    predicted = 0.0
+    if cfg.history:
+        from .scheduler import Scheduler
+        scheduler = Scheduler(cfg)
+        testcases = scheduler.order(testcases)
+        predicted = scheduler.predictMakespan(testcases, [(name, workers) for name, function, workers in stages])
+
+    profiler = None
+    if cfg.profile:
+        from .profiling import Profiler
+        profiler = Profiler()
+        profiler.start()
+
+    pipeline = Pipeline(testcases, stages, scheduler, profiler)
+    pipeline.run()
+
+    if profiler is not None:
+        profiler.stop()
+        profiler.write(cfg)
+        if cfg.silent == False: print("Profile written to "+cfg.directory+cfg.profileFile+".txt and .folded")
+
+    if cfg.mode == 2:
+        diffExecutor.stop()
+
+    if cfg.renderCache:
+        from .renderers import pruneRenderCache
+        pruneRenderCache(cfg)
+
+    if cfg.dedupe:
+        from .objects import pruneObjects
+        pruneObjects(cfg)
+
+    for renderer in renderers:
+        renderer.stop()
+
+    if cfg.silent == False: print("All threads finished.")
+    if cfg.silent == False: pipeline.printStatistics()
+    pipeline.runLog.write(cfg, pipeline.duration)
+    if scheduler is not None:
+        # a testcase without a build says nothing about the next real one
+        scheduler.save(skip=dataCollection.cachedBuilds)
+        if cfg.silent == False and predicted > 0:
+            print("Predicted duration: %.1f s, actual: %.1f s" % (predicted, pipeline.duration))
+    if cfg.silent == False: printBuildFailures(dataCollection)
+    from .journal import compact
+    compact(cfg, dataCollection, cfg.mode)
+    dataCollection.journal.finish()
+
+
+def bindStage(function, cfg, dataCollection):
+    return lambda testcase: function(cfg, dataCollection, testcase)
+
+
+def printBuildFailures(dataCollection):
+    failures = []
+    for testcase in sorted(dataCollection.buildStatus):
+        for dcFile in sorted(dataCollection.buildStatus[testcase]):
+            for filetype, returncode in sorted(dataCollection.buildStatus[testcase][dcFile].items()):
+                if returncode != 0:
+                    failures.append(testcase+dcFile+" "+filetype+" (exit code "+str(returncode)+")")
+    if len(failures) > 0:
+        print("\n=== Failed Builds ===\n")
+        for failure in failures:
+            print(failure)
 
 
 def queueTestcases(cfg, silent=False):
@@ -362,6 +946,9 @@ def queueTestcases(cfg, silent=False):
 
 def findTestcases(cfg):
     for testcase in os.listdir(cfg.directory):
+        # hidden folders like the cache are no testcases
+        if testcase.startswith("."):
+            continue
         if(os.path.isdir(cfg.directory+"/"+testcase)):
             yield testcase
 
@@ -390,6 +977,14 @@ def cleanDirectories(cfg, testcaseSubfolders=['dapscompare-reference', 'dapscomp
             os.remove(cfg.directory+cfg.resDiffFile)
         except:
             pass
+        try:
+            os.remove(cfg.directory+cfg.journalFile)
+        except:
+            pass
+        try:
+            shutil.rmtree(cacheFolder(cfg))
+        except:
+            pass
 
 
 def printResults(cfg, dataCollection):
@@ -400,5 +995,10 @@ def printResults(cfg, dataCollection):
         print("\n=== Differing Page Numbers ===\n")
         for item in dataCollection.diffNumPages:
             print(item[0])
+            if len(item) > 3:
+                for page in item[3]['removed']:
+                    print("  removed: "+page)
+                for page in item[3]['inserted']:
+                    print("  inserted: "+page)
     else:
         print(json.dumps(dataCollection.imgDiffs, sort_keys=True))
@@ -10,67 +10,139 @@
 # 
 # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-import sys, signal, os, time, math
+import sys, signal, os, time, math, json
 
-from io import BytesIO
 from PIL import Image
 
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 from PyQt4.QtWebKit import QWebPage
 
-# This class renders an image from a website using WebKit
 class html2png():
 
-    # get URL and pixel width as parameters. The width is only approximate
-    def __init__(self,source,target,width):
-        self.width = int(width)
-        self.target = target
-        #self.app = QApplication(sys.argv)
+    # one QWebPage is reused for all pages rendered by this process
+    def __init__(self):
         signal.signal(signal.SIGINT, signal.SIG_DFL)
         self.qwPage = QWebPage()
+        self.loop = QEventLoop()
+        self.result = False
+        self.format = "png"
+        self.compression = 9
+        self.qwPage.connect(self.qwPage, SIGNAL("loadFinished(bool)"), self.onLoadFinished)
 
-        size = QSize()
-        size.setWidth(int(width))
-        self.qwPage.setViewportSize(size)
+    # get URL and a list of (pixel width, target) pairs. The width is only approximate.
+    # The page is loaded once and laid out again for every width.
+    def render(self,source,targets,format="png",compression=9):
+        self.format = format
+        self.compression = int(compression)
+        self.targets = [(int(width), target) for width, target in targets]
+        self.result = False
+
+        self.setWidth(self.targets[0][0])
 
-        self.qwPage.connect(self.qwPage, SIGNAL("loadFinished(bool)"), self.onLoadFinished)
         self.qwPage.mainFrame().load(QUrl(source))
+        # wait until onLoadFinished has written all slices
+        self.loop.exec_()
+        return self.result
+
+    def setWidth(self,width):
+        self.width = width
+        size = QSize()
+        size.setWidth(width)
+        self.qwPage.setViewportSize(size)
+        # reading a layout property makes WebKit lay out the page for the new width
+        self.qwPage.mainFrame().evaluateJavaScript("document.documentElement.offsetHeight")
 
     # do not call this function. it is called via a signal
     def onLoadFinished(self,result):
-        if not result:
-            sys.exit(1)
+        self.result = False
+        try:
+            if result:
+                for width, target in self.targets:
+                    if width != self.width:
+                        self.setWidth(width)
+                    self.renderSlices(target)
+            self.result = result
+        finally:
+            # render() must return even if painting or saving failed
+            self.loop.quit()
 
-        # Set the size of the (virtual) browser window
-        self.qwPage.setViewportSize(self.qwPage.mainFrame().contentsSize())
+    def renderSlices(self,target):
+        frame = self.qwPage.mainFrame()
+        contentsSize = frame.contentsSize()
 
-        # Paint this frame into an image
-        image = QImage(self.qwPage.viewportSize(), QImage.Format_RGB32)
-        painter = QPainter(image)
-        self.qwPage.mainFrame().render(painter)
-        painter.end()
+        # Set the size of the (virtual) browser window, otherwise only the visible part is painted
+        self.qwPage.setViewportSize(contentsSize)
+
+        # Paint the frame slice by slice into one reusable image, so memory
+        # depends on the page width and not on the length of the document
         targetHeight = self.width * 1.4142
-        numSplits = math.ceil(image.height() / targetHeight)
+        sliceWidth = contentsSize.width()
+        sliceHeight = int(targetHeight-1)
+        image = QImage(sliceWidth, sliceHeight, QImage.Format_RGB32)
+        numSplits = math.ceil(contentsSize.height() / targetHeight)
         for x in range(0,numSplits):
-            start = (x) * targetHeight
-            copy = image.copy( 0, int(start), image.width(), targetHeight-1)
-            self.saveOptPNG(copy,self.target[:-4]+"."+str(x)+".png")
+            start = int((x) * targetHeight)
+            # below the end of the page the slice stays black, like QImage.copy did before
+            image.fill(0)
+            painter = QPainter(image)
+            painter.translate(0, -start)
+            frame.render(painter, QRegion(0, start, sliceWidth, sliceHeight))
+            painter.end()
+            saveImage(image,target[:-4]+"."+str(x)+"."+self.format,self.format,self.compression)
+
+
+# write the pixel buffer of a QImage.Format_RGB32 image directly with PIL.
+# format "png" is compressed with zlib level compression (0-9),
+# "ppm" is written uncompressed.
+def saveImage(img,path,format="png",compression=9):
+    bits = img.constBits()
+    bits.setsize(img.byteCount())
+    # RGB32 is stored as B, G, R, 0xff on little endian machines
+    pil_im = Image.frombuffer("RGB", (img.width(), img.height()), bits, "raw", "BGRX", img.bytesPerLine(), 1)
+    if format == "ppm":
+        pil_im.save(path, "PPM")
+    else:
+        pil_im.save(path, "PNG", optimize=False, compress_level=compression)
+
+
+# render server: read one JSON job per line from stdin and answer with one
+# JSON line on stdout. Keeps QtWebKit loaded between jobs.
+def serve(renderer):
+    for line in iter(sys.stdin.readline, ''):
+        if not line.strip():
+            continue
+        job = json.loads(line)
+        start = time.time()
+        try:
+            result = renderer.render(job['source'], job['targets'], job.get('format', "png"), job.get('compression', 9))
+        except Exception:
+            result = False
+        sys.stdout.write(json.dumps({'ok': bool(result), 'time': time.time() - start})+"\n")
+        sys.stdout.flush()
+
+
+def main():
+    app = QApplication(sys.argv)
+    renderer = html2png()
+    if sys.argv[1] == "--server":
+        serve(renderer)
+        sys.exit(0)
+    # html2png.py [--format=png] [--compression=9] SOURCE TARGET WIDTH [TARGET WIDTH ...]
+    format = "png"
+    compression = 9
+    args = []
+    for parameter in sys.argv[1:]:
+        if parameter.startswith("--format="):
+            format = parameter[9:]
+        elif parameter.startswith("--compression="):
+            compression = int(parameter[14:])
+        else:
+            args.append(parameter)
+    targets = [(args[n+1], args[n]) for n in range(1, len(args) - 1, 2)]
+    if renderer.render(args[0],targets,format,compression):
         sys.exit(0)
+    sys.exit(1)
 
-    #optimize QImage PNG with PIL and save
-    def saveOptPNG(self,img,path):
-        buffer = QBuffer()
-        buffer.open(QIODevice.ReadWrite)
-        img.save(buffer, "PNG")
-
-        strio = BytesIO()
-        strio.write(buffer.data())
-        buffer.close()
-        strio.seek(0)
-        pil_im = Image.open(strio)
-        pil_im.save(path, "PNG", optimize=False,compress_level=9)
-
-app = QApplication(sys.argv)
-asdf = html2png(sys.argv[1],sys.argv[2],sys.argv[3])
-sys.exit(app.exec_())
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+# The MIT License (MIT)
+# 
+# Copyright (c) 2017, Sven Seeberg-Elverfeldt <sseebergelverfeldt@suse.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# Results of a reference or compare run are appended to
+# dapscompare-journal.jsonl as soon as they are known, one JSON object
+# per line: {"kind": "start", "mode": 2, "pid": 123, "time": ...} first,
+# then "hash" (md5, params), "diff" (item) and "pages" (item) records and
+# {"kind": "end"} when the run has written dapscompare-hash.json and
+# dapscompare-diff.json. A journal without an end record belongs to a
+# run which is still going or was interrupted.
+
+import os
+import json
+import time
+import threading
+
+from .helpers import readFile, writeFile
+
+
+class Journal:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+
+    def start(self, mode):
+        self.file = open(self.path, 'w')
+        self.append({'kind': 'start', 'mode': mode, 'pid': os.getpid(), 'time': time.time()})
+
+    def append(self, record):
+        if self.file is None:
+            return
+        line = json.dumps(record, sort_keys=True)+"\n"
+        self.lock.acquire()
+        # one write per line, so readers never see half a record
+        self.file.write(line)
+        self.file.flush()
+        self.lock.release()
+
+    def finish(self):
+        self.append({'kind': 'end', 'time': time.time()})
+        self.file.close()
+        self.file = None
+
+
+# complete records from offset on and the offset after the last of them
+def readJournal(path, offset=0):
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        return [], offset
+    f.seek(offset)
+    content = f.read()
+    f.close()
+    records = []
+    end = content.rfind(b"\n") + 1
+    for line in content[:end].splitlines():
+        try:
+            records.append(json.loads(line.decode('utf-8')))
+        except ValueError:
+            pass
+    return records, offset + end
+
+
+def processRunning(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# "complete", "running", "interrupted" or None without journal
+def journalState(records):
+    if len(records) == 0 or records[0].get('kind') != 'start':
+        return None
+    if records[-1].get('kind') == 'end':
+        return "complete"
+    if records[0]['pid'] != os.getpid() and processRunning(records[0]['pid']):
+        return "running"
+    return "interrupted"
+
+
+# add the records to a DataCollector or Results
+def replay(records, results):
+    for record in records:
+        kind = record.get('kind')
+        if kind == 'hash':
+            results.depHashes[record['md5']] = record['params']
+        elif kind == 'diff':
+            results.imgDiffs.append(record['item'])
+        elif kind == 'pages':
+            results.diffNumPages.append(record['item'])
+
+
+class Results:
+    def __init__(self):
+        self.depHashes = {}
+        self.imgDiffs = []
+        self.diffNumPages = []
+
+
+# write the results into dapscompare-hash.json and, for compare runs,
+# dapscompare-diff.json
+def compact(cfg, results, mode):
+    if mode == 2:
+        writeFile(cfg.directory+cfg.resDiffFile, json.dumps([results.imgDiffs, results.diffNumPages], sort_keys=True))
+    writeFile(cfg.directory+cfg.resHashFile, json.dumps(results.depHashes, sort_keys=True))
+
+
+# results of a run which was interrupted are written to the result files
+# before a new run starts or the viewer shows them
+def recover(cfg):
+    path = cfg.directory+cfg.journalFile
+    records, offset = readJournal(path)
+    if journalState(records) != "interrupted":
+        return
+    if cfg.silent == False: print("Saving the results of the interrupted run in "+path)
+    results = Results()
+    content = readFile(cfg.directory+cfg.resHashFile)
+    if content and len(content) > 2:
+        results.depHashes = json.loads(content)
+    replay(records, results)
+    compact(cfg, results, records[0]['mode'])
+    f = open(path, 'a')
+    f.write(json.dumps({'kind': 'end', 'interrupted': True, 'time': time.time()}, sort_keys=True)+"\n")
+    f.close()
+
+
+# print the diff and page count records of the journal as they come in,
+# until the run has finished, for --json consumers of "dapscmp view"
+def follow(cfg, interval=1.0):
+    path = cfg.directory+cfg.journalFile
+    offset = 0
+    first = None
+    while True:
+        records, offset = readJournal(path, offset)
+        if first is None and len(records) > 0:
+            first = records[0]
+        for record in records:
+            if record.get('kind') in ['diff', 'pages']:
+                print(json.dumps(record, sort_keys=True), flush=True)
+            elif record.get('kind') == 'end':
+                return
+        if first is None or journalState([first]) != "running":
+            return
+        time.sleep(interval)
@@ -0,0 +1,73 @@
+# The MIT License (MIT)
+# 
+# Copyright (c) 2017, Sven Seeberg-Elverfeldt <sseebergelverfeldt@suse.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# Content addressed storage of rendered pages. Every page is a hardlink
+# to .dapscompare-cache/objects/<sha1[:2]>/<sha1>, so identical pages of
+# different testcases, widths, reference and comparison take up disk
+# space only once, and a reference is updated by relinking.
+
+import os
+import threading
+
+from .helpers import cacheFolder, hashPath, listFiles
+
+
+def objectPath(cfg, digest):
+    return cacheFolder(cfg, "objects", digest[:2], digest)
+
+
+# atomically replace target with a hardlink to source
+def relink(source, target):
+    temp = target+".tmp-"+str(threading.get_ident())
+    os.link(source, temp)
+    os.replace(temp, target)
+
+
+# turn the file at path into a link to the object with its content
+def storeObject(cfg, path, digest=None):
+    if digest is None:
+        digest = hashPath(path)
+    target = objectPath(cfg, digest)
+    try:
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                os.link(path, target)
+                return
+            except FileExistsError:
+                # another thread stored the same page just now
+                pass
+        if not os.path.samefile(target, path):
+            relink(target, path)
+    except OSError:
+        # no hardlinks on this file system, keep the file as it is
+        pass
+
+
+# digests is {filename: sha1} as in the manifest of the folder
+def storeFolder(cfg, folder, digests):
+    for filename in listFiles(folder):
+        storeObject(cfg, os.path.join(folder, filename), digests.get(filename))
+
+
+# objects which are not linked from anywhere else any more
+def pruneObjects(cfg):
+    removed = 0
+    root = cacheFolder(cfg, "objects")
+    if not os.path.isdir(root):
+        return removed
+    for prefix in os.listdir(root):
+        for digest in os.listdir(os.path.join(root, prefix)):
+            path = os.path.join(root, prefix, digest)
+            if os.stat(path).st_nlink == 1:
+                os.remove(path)
+                removed = removed + 1
+    return removed
@@ -0,0 +1,85 @@
+# The MIT License (MIT)
+# 
+# Copyright (c) 2017, Sven Seeberg-Elverfeldt <sseebergelverfeldt@suse.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# All pages of a reference folder decoded into one uncompressed file,
+# dapscompare-reference/<md5>.pages, which is read with mmap. The offset
+# of every page is kept in the folder's manifest. Comparing then reads
+# reference pages as slices of the mapped file instead of decoding the
+# PNGs again, and the OS keeps the file in its page cache for all
+# threads and runs.
+
+import os
+
+import numpy as np
+from scipy.misc import imread
+
+from .helpers import listFiles, pageStorePath, readManifest, writeManifest
+
+# pages start at multiples of the memory page size
+alignment = 4096
+
+
+# a stored page is only valid while its PNG is unchanged
+def fileStamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def buildPageStore(folder):
+    index = {}
+    temp = pageStorePath(folder)+".tmp"
+    offset = 0
+    with open(temp, 'wb') as f:
+        for filename in sorted(listFiles(folder)):
+            image = np.ascontiguousarray(imread(os.path.join(folder, filename)))
+            offset = -(-offset // alignment) * alignment
+            f.seek(offset)
+            f.write(image.tobytes())
+            index[filename] = {'offset': offset, 'shape': list(image.shape), 'dtype': image.dtype.str, 'stamp': fileStamp(os.path.join(folder, filename))}
+            offset = offset + image.nbytes
+    os.rename(temp, pageStorePath(folder))
+    manifest = readManifest(folder)
+    manifest['store'] = index
+    writeManifest(folder, manifest)
+
+
+class PageStore:
+    def __init__(self, folder):
+        self.folder = folder
+        self.index = readManifest(folder).get('store')
+        self.data = None
+        if self.index is not None and os.path.exists(pageStorePath(folder)) and os.path.getsize(pageStorePath(folder)) > 0:
+            self.data = np.memmap(pageStorePath(folder), dtype=np.uint8, mode='r')
+
+    def valid(self):
+        return self.data is not None
+
+    # the decoded page as read-only array backed by the mapped file, or
+    # None if the page is not in the store or its PNG has changed
+    def get(self, filename):
+        if self.data is None or filename not in self.index:
+            return None
+        page = self.index[filename]
+        path = os.path.join(self.folder, filename)
+        if not os.path.exists(path) or fileStamp(path) != page['stamp']:
+            return None
+        dtype = np.dtype(page['dtype'])
+        size = int(np.prod(page['shape'])) * dtype.itemsize
+        return self.data[page['offset']:page['offset'] + size].view(dtype).reshape(page['shape'])
+
+
+# the store of a reference folder, built on first use
+def openPageStore(folder):
+    store = PageStore(folder)
+    if not store.valid() and len(listFiles(folder)) > 0:
+        buildPageStore(folder)
+        store = PageStore(folder)
+    return store
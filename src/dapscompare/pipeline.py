@@ -0,0 +1,171 @@
+# The MIT License (MIT)
+# 
+# Copyright (c) 2017, Sven Seeberg-Elverfeldt <sseebergelverfeldt@suse.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+import sys
+import threading
+import queue
+import time
+import traceback
+
+from PyQt5 import QtCore
+
+from .runlog import RunLog
+
+
+class Stage:
+    # one step of the pipeline with its own worker threads. Testcases are
+    # taken from inputQueue and, when done, put into outputQueue.
+    def __init__(self, name, function, workers, inputQueue, outputQueue=None, runLog=None, scheduler=None, first=False, profiler=None):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.inputQueue = inputQueue
+        self.outputQueue = outputQueue
+        self.runLog = runLog
+        # testcases are admitted by the scheduler when they enter the first stage
+        self.scheduler = scheduler
+        self.first = first
+        self.profiler = profiler
+        self.threads = []
+        self.lock = threading.Lock()
+        self.busy = 0.0
+        self.items = 0
+        # queue depth statistics, filled by Pipeline.monitor
+        self.samples = 0
+        self.depthSum = 0
+        self.depthMax = 0
+
+    def addBusy(self, seconds):
+        self.lock.acquire()
+        self.busy = self.busy + seconds
+        self.items = self.items + 1
+        self.lock.release()
+
+    def start(self):
+        for threadX in range(0, self.workers):
+            thread = stageThread(self, self.name+"-"+str(threadX))
+            thread.start()
+            self.threads.append(thread)
+
+    def wait(self):
+        for thread in self.threads:
+            thread.wait()
+
+
+class stageThread (QtCore.QThread):
+    def __init__(self, stage, name):
+        QtCore.QThread.__init__(self)
+        self.stage = stage
+        self.name = name
+
+    def run(self):
+        # None marks the end of the queue
+        while True:
+            testcase = self.stage.inputQueue.get()
+            if testcase is None:
+                break
+            scheduler = self.stage.scheduler
+            if scheduler is not None and self.stage.first:
+                scheduler.admit(testcase)
+            span = None
+            if self.stage.runLog is not None:
+                span = self.stage.runLog.begin(testcase, self.stage.name)
+            profiler = self.stage.profiler
+            profile = None
+            start = time.time()
+            failed = False
+            try:
+                if profiler is not None:
+                    profile = profiler.enterThread(self.stage.name)
+                self.stage.function(testcase)
+            except Exception:
+                # a broken testcase must not stop the whole pipeline
+                print(self.name+" failed on "+testcase, file=sys.stderr)
+                traceback.print_exc()
+                failed = True
+            finally:
+                if profiler is not None:
+                    profiler.leaveThread(profile)
+            self.stage.addBusy(time.time() - start)
+            if span is not None:
+                self.stage.runLog.end(span)
+            if scheduler is not None:
+                scheduler.addTime(testcase, self.stage.name, time.time() - start)
+                if span is not None:
+                    scheduler.addMemory(testcase, span.rss)
+                if failed or self.stage.outputQueue is None:
+                    scheduler.finish(testcase)
+            if self.stage.outputQueue is not None and not failed:
+                self.stage.outputQueue.put(testcase)
+
+
+class Pipeline:
+    # stages are given as (name, function, number of workers). Between two
+    # stages is a queue which holds at most twice as many testcases as the
+    # next stage has workers, so a fast stage cannot run far ahead.
+    # Testcases run in the given order; a scheduler, see scheduler.py,
+    # can hold them back before the first stage.
+    def __init__(self, testcases, stages, scheduler=None, profiler=None):
+        self.runLog = RunLog()
+        self.inputQueue = queue.Queue()
+        for testcase in testcases:
+            self.inputQueue.put(testcase)
+        self.stages = []
+        inputQueue = self.inputQueue
+        for n in range(0, len(stages)):
+            name, function, workers = stages[n]
+            outputQueue = None
+            if n + 1 < len(stages):
+                outputQueue = queue.Queue(maxsize=2 * stages[n+1][2])
+            self.stages.append(Stage(name, function, workers, inputQueue, outputQueue, self.runLog, scheduler, n == 0, profiler))
+            inputQueue = outputQueue
+        self.running = False
+        self.duration = 0.0
+
+    def monitor(self):
+        while self.running:
+            for stage in self.stages:
+                depth = stage.inputQueue.qsize()
+                stage.samples = stage.samples + 1
+                stage.depthSum = stage.depthSum + depth
+                stage.depthMax = max(stage.depthMax, depth)
+            time.sleep(0.5)
+
+    def run(self):
+        start = time.time()
+        self.running = True
+        monitorThread = threading.Thread(target=self.monitor)
+        monitorThread.daemon = True
+        monitorThread.start()
+
+        for stage in self.stages:
+            stage.start()
+        # when a stage is done, tell the workers of the next stage to finish
+        for stage in self.stages:
+            for threadX in range(0, stage.workers):
+                stage.inputQueue.put(None)
+            stage.wait()
+
+        self.running = False
+        monitorThread.join()
+        self.duration = time.time() - start
+
+    def printStatistics(self):
+        print("\n=== Pipeline ===\n")
+        print("Duration: %.1f s" % self.duration)
+        for stage in self.stages:
+            utilization = 0.0
+            if self.duration > 0 and stage.workers > 0:
+                utilization = 100 * stage.busy / (stage.workers * self.duration)
+            depthMean = 0.0
+            if stage.samples > 0:
+                depthMean = stage.depthSum / stage.samples
+            print("%-8s %2d threads, %4d testcases, utilization %5.1f %%, queue depth mean %.1f max %d" % (stage.name, stage.workers, stage.items, utilization, depthMean, stage.depthMax))
@@ -0,0 +1,187 @@
+# The MIT License (MIT)
+# 
+# Copyright (c) 2017, Sven Seeberg-Elverfeldt <sseebergelverfeldt@suse.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# --profile: cProfile for every worker thread, a sampler which collects
+# the Python stacks of the worker threads for flame graphs, tracemalloc
+# for allocations and the wall time of every external command. Written
+# to dapscompare-profile.txt and dapscompare-profile.folded, which
+# flamegraph.pl reads.
+
+import io
+import os
+import sys
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+
+# functions of dapscompare which are listed in the summary on their own
+hotPaths = ['runRenderers', 'renderCached', 'runTests', 'registerHash', 'diffImages', 'findRegions']
+
+def frameName(frame):
+    code = frame.f_code
+    return os.path.basename(code.co_filename)+":"+code.co_name
+
+
+class Profiler:
+    def __init__(self, interval=0.005, snapshotInterval=10.0):
+        self.interval = interval
+        self.snapshotInterval = snapshotInterval
+        self.lock = threading.Lock()
+        self.stats = None
+        # thread ident -> stage name, for the sampler
+        self.threads = {}
+        # folded stack -> number of samples
+        self.stacks = {}
+        self.samples = 0
+        self.commands = []
+        self.running = False
+        self.sampler = None
+        self.duration = 0.0
+        # allocations at the moment most memory was traced
+        self.snapshot = None
+        self.snapshotMemory = 0
+        self.peakMemory = 0
+        # since Python 3.12 cProfile uses sys.monitoring, which sees all
+        # threads and allows one active profiler only. One profile then
+        # covers the whole run instead of one per worker thread.
+        self.runProfile = None
+
+    def start(self):
+        from . import runlog
+        runlog.profiler = self
+        if sys.version_info >= (3, 12):
+            self.runProfile = cProfile.Profile()
+            self.runProfile.enable()
+        tracemalloc.start(16)
+        self.startTime = time.time()
+        self.running = True
+        self.sampler = threading.Thread(target=self.sample)
+        self.sampler.daemon = True
+        self.sampler.start()
+
+    def stop(self):
+        from . import runlog
+        self.running = False
+        self.sampler.join()
+        self.duration = time.time() - self.startTime
+        self.takeSnapshot()
+        self.peakMemory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        if self.runProfile is not None:
+            self.runProfile.disable()
+            self.addStats(self.runProfile)
+        runlog.profiler = None
+
+    # called by a worker thread before and after each testcase
+    def enterThread(self, stage):
+        self.lock.acquire()
+        self.threads[threading.get_ident()] = stage
+        self.lock.release()
+        if self.runProfile is not None:
+            return None
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def leaveThread(self, profile):
+        self.lock.acquire()
+        self.threads.pop(threading.get_ident(), None)
+        self.lock.release()
+        if profile is not None:
+            profile.disable()
+            self.addStats(profile)
+
+    def addStats(self, profile):
+        self.lock.acquire()
+        if self.stats is None:
+            self.stats = pstats.Stats(profile)
+        else:
+            self.stats.add(profile)
+        self.lock.release()
+
+    def takeSnapshot(self):
+        memory = tracemalloc.get_traced_memory()[0]
+        if memory > self.snapshotMemory:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.snapshotMemory = memory
+
+    def sample(self):
+        lastSnapshot = time.time()
+        while self.running:
+            if time.time() - lastSnapshot > self.snapshotInterval:
+                self.takeSnapshot()
+                lastSnapshot = time.time()
+            frames = sys._current_frames()
+            self.lock.acquire()
+            for ident, stage in self.threads.items():
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    stack.append(frameName(frame))
+                    frame = frame.f_back
+                stack.append(stage)
+                folded = ";".join(reversed(stack))
+                self.stacks[folded] = self.stacks.get(folded, 0) + 1
+            self.samples = self.samples + 1
+            self.lock.release()
+            time.sleep(self.interval)
+
+    # called by runlog.recordProcesses for every finished process
+    def addCommand(self, command, seconds):
+        self.lock.acquire()
+        self.commands.append((command, seconds))
+        self.lock.release()
+
+    def write(self, cfg):
+        f = open(cfg.directory+cfg.profileFile+".folded", 'w')
+        for stack, count in sorted(self.stacks.items()):
+            f.write(stack+" "+str(count)+"\n")
+        f.close()
+        f = open(cfg.directory+cfg.profileFile+".txt", 'w')
+        f.write(self.summary())
+        f.close()
+
+    def summary(self):
+        out = io.StringIO()
+        out.write("=== Profile ===\n\n")
+        out.write("Duration: %.1f s, %d stack samples\n" % (self.duration, self.samples))
+
+        out.write("\n=== Hot Paths ===\n\n")
+        if self.stats is not None:
+            for key, (primitive, calls, total, cumulative, callers) in sorted(self.stats.stats.items()):
+                if key[2] in hotPaths and os.path.dirname(key[0]).endswith("dapscompare"):
+                    out.write("%-16s %8d calls, %8.2f s own, %8.2f s cumulative\n" % (key[2], calls, total, cumulative))
+
+        out.write("\n=== External Commands ===\n\n")
+        programs = {}
+        for command, seconds in self.commands:
+            program = os.path.basename(command.split()[0]) if command else "?"
+            count, total = programs.get(program, (0, 0.0))
+            programs[program] = (count + 1, total + seconds)
+        for program, (count, total) in sorted(programs.items(), key=lambda item: item[1][1], reverse=True):
+            out.write("%-16s %6d processes, %8.1f s\n" % (program, count, total))
+        out.write("\nSlowest:\n")
+        for command, seconds in sorted(self.commands, key=lambda item: item[1], reverse=True)[:10]:
+            out.write("%8.1f s  %s\n" % (seconds, command))
+
+        out.write("\n=== Memory Allocations ===\n\n")
+        out.write("Peak of traced memory: %d MB, largest allocations at %d MB:\n\n" % (self.peakMemory // 2**20, self.snapshotMemory // 2**20))
+        if self.snapshot is not None:
+            for statistic in self.snapshot.statistics('lineno')[:20]:
+                out.write(str(statistic)+"\n")
+
+        out.write("\n=== Functions by Cumulative Time ===\n\n")
+        if self.stats is not None:
+            self.stats.stream = out
+            self.stats.sort_stats('cumulative').print_stats(40)
+        return out.getvalue()
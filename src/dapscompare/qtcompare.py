@@ -14,11 +14,10 @@ import sys
 from scipy.misc import *
 from .helpers import *
 from PIL import ImageDraw, Image
-from scipy.cluster.vq import kmeans2, whiten, kmeans
 import json
-import shutil
-import time
-import os
+import bisect
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 gray_color_table = [QtGui.qRgb(i, i, i) for i in range(256)]
 
@@ -27,7 +26,7 @@ def spawnGui(app, cfg, dataCollection):
     from .qtcompare import qtImageCompare
     if cfg.noGui is False:
         if cfg.silent == False: print("Starting Qt GUI")
-        if len(dataCollection.imgDiffs) > 0 or len(dataCollection.diffNumPages) > 0:
+        if len(dataCollection.imgDiffs) > 0 or len(dataCollection.diffNumPages) > 0 or dataCollection.following:
             ex = qtImageCompare(cfg, dataCollection)
             sys.exit(app.exec_())
 
@@ -52,6 +51,55 @@ def toQImage(im, copy=False):
 
     raise NotImplementedException
 
+class PixmapCache:
+    # least recently used pairs of display pixmaps, limited to budget bytes
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+        self.items = OrderedDict()
+
+    def pixmapSize(self, pixmaps):
+        return sum([pixmap.width() * pixmap.height() * pixmap.depth() // 8 for pixmap in pixmaps])
+
+    def get(self, key):
+        if key not in self.items:
+            return None
+        self.items.move_to_end(key)
+        return self.items[key]
+
+    def put(self, key, pixmaps):
+        self.remove(key)
+        self.items[key] = pixmaps
+        self.size = self.size + self.pixmapSize(pixmaps)
+        # always keep the newest item, even if it alone is over budget
+        while self.size > self.budget and len(self.items) > 1:
+            oldest = next(iter(self.items))
+            self.remove(oldest)
+
+    def remove(self, key):
+        if key in self.items:
+            self.size = self.size - self.pixmapSize(self.items.pop(key))
+
+
+# load both images of a diff entry, mark the changes and scale them down
+# to size. Runs in a thread of the prefetch pool, so only QImages are
+# created here, QPixmaps must be created in the GUI thread.
+def prepareImages(path, size):
+    referenceImage, comparisonImage = markRegions(path)
+    images = []
+    for image in [referenceImage, comparisonImage]:
+        qimage = toQImage(np.ascontiguousarray(image), copy=True)
+        if qimage.width() > size.width() or qimage.height() > size.height():
+            qimage = qimage.scaled(size, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+        images.append(qimage)
+    return images
+
+
+class ImageLoader(QtCore.QObject):
+    # emitted in the GUI thread when the images of a diff entry are ready
+    loaded = QtCore.pyqtSignal(str, object)
+
+
 class qtImageCompare(QtWidgets.QMainWindow):
     # list images format list of triple reference image path, comparison image path, difference map image path 
     # [['reference path', 'comparison path', 'diffmap path'], ['reference path', 'comparison path', 'diffmap path'], [...] ...]
@@ -73,6 +121,7 @@ class qtImageCompare(QtWidgets.QMainWindow):
         self.viewDirectory = cfg.directory
         self.cfg = cfg
         imagesList = dta.imgDiffs
+        self.dta = dta
         self.depHashes = dta.depHashes
         self.imagesList = sorted(imagesList, key=lambda imagesList: imagesList[1])
         self.imagePos = 0
@@ -80,9 +129,16 @@ class qtImageCompare(QtWidgets.QMainWindow):
         self.resize(800,600)
         self.setMinimumWidth(800)
         self.setMinimumHeight(600)
-        self.calculatedImages = {}
-        for n in range(0,len(self.imagesList)):
-            self.calculatedImages[n] = None
+        # display pixmaps of visited and prefetched images, keyed by comparison path
+        self.imageCache = PixmapCache(cfg.viewerCache * 1024 * 1024)
+        # the two images are shown side by side, each at most half the screen wide and as high as the screen
+        self.displaySize = QtCore.QSize(max(self.screenShape.width() // 2, 400), max(self.screenShape.height(), 300))
+        self.prefetchPool = ThreadPoolExecutor(max_workers=2)
+        self.prefetching = {}
+        self.loader = ImageLoader()
+        self.loader.loaded.connect(self.imagesLoaded)
+        self.pixmapLeft = QtGui.QPixmap()
+        self.pixmapRight = QtGui.QPixmap()
 
         # Left image (reference)
         self.leftImage = QtWidgets.QLabel(self)
@@ -113,6 +169,10 @@ class qtImageCompare(QtWidgets.QMainWindow):
         refAction.setShortcut('Ctrl+R')
         refAction.setStatusTip('Set image as reference')
         refAction.triggered.connect(self.makeRef)
+        # the running comparison writes the diff list when it is done, pages
+        # accepted before would appear again. Enabled when the run has ended.
+        refAction.setEnabled(not dta.following)
+        self.refAction = refAction
 
         openAction = QtWidgets.QAction('&Open', self)
         openAction.setShortcut('Ctrl+O')
@@ -135,31 +195,76 @@ class qtImageCompare(QtWidgets.QMainWindow):
         fileMenu.addAction(copyAction)
         fileMenu.addAction(exitAction)
         # load initial images
-        self.loadImage(self.imagesList[self.imagePos])
+        if len(self.imagesList) > 0:
+            self.loadImage(self.imagesList[self.imagePos])
+        else:
+            self.statusBar().showMessage("Waiting for results of the running comparison")
+
+        # pages of a running comparison are added as they are compared
+        if dta.following:
+            self.journalTimer = QtCore.QTimer(self)
+            self.journalTimer.timeout.connect(self.readJournal)
+            self.journalTimer.start(1000)
 
         self.show()
 
+    @QtCore.pyqtSlot()
+    def readJournal(self):
+        from .journal import readJournal
+        records, self.dta.journalOffset = readJournal(self.viewDirectory+self.cfg.journalFile, self.dta.journalOffset)
+        for record in records:
+            if record.get('kind') == 'diff':
+                self.insertImage(record['item'])
+            elif record.get('kind') == 'pages':
+                self.dta.diffNumPages.append(record['item'])
+            elif record.get('kind') == 'hash':
+                self.depHashes[record['md5']] = record['params']
+            elif record.get('kind') == 'end':
+                self.journalTimer.stop()
+                self.dta.following = False
+                self.refAction.setEnabled(True)
+        if len(self.imagesList) > 0 and self.pixmapRight.isNull() and self.imagesList[self.imagePos][1] not in self.prefetching:
+            self.loadImage(self.imagesList[self.imagePos])
+
+    # keep the list sorted by comparison path and the current image in place
+    def insertImage(self, item):
+        position = bisect.bisect([entry[1] for entry in self.imagesList], item[1])
+        self.imagesList.insert(position, item)
+        if position <= self.imagePos and len(self.imagesList) > 1:
+            self.imagePos = self.imagePos + 1
+
     @QtCore.pyqtSlot()
     def makeRef(self):
+        if len(self.imagesList) == 0:
+            return
+        if self.dta.following:
+            self.statusBar().showMessage("Pages can be accepted when the comparison has finished")
+            return
         quit_msg = "Are you sure you make this image a reference image?"
         reply = QtWidgets.QMessageBox.question(self, 'Attention!', quit_msg,
                                                QtWidgets.QMessageBox.Yes, QtWidgets.QMessageBox.No)
         if reply == QtWidgets.QMessageBox.No:
             return
-        shutil.copyfile(self.imagesList[self.imagePos][1],self.imagesList[self.imagePos][0])
+        entry = self.imagesList[self.imagePos]
+        # refined PDF pages are shown in high resolution, accept the pages of the first pass
+        if len(entry) > 3 and 'source' in entry[3]:
+            entry = entry[3]['source']
+        acceptPage(entry[1],entry[0])
         if(len(self.imagesList) == 1):
             self.imagesList=[]
-            writeFile(self.viewDirectory+self.cfg.resDiffFile,json.dumps(self.imagesList))
+            writeFile(self.viewDirectory+self.cfg.resDiffFile,json.dumps([self.imagesList, self.dta.diffNumPages]))
             sys.exit()
         self.imagesList = self.imagesList[:self.imagePos] + self.imagesList[self.imagePos+1 :]
         self.imagePos = self.imagePos - 1
         if self.imagePos == -1:
             self.imagePos = 0
         self.loadImage(self.imagesList[self.imagePos])
-        writeFile(self.viewDirectory+self.cfg.resDiffFile,json.dumps(self.imagesList))
+        writeFile(self.viewDirectory+self.cfg.resDiffFile,json.dumps([self.imagesList, self.dta.diffNumPages]))
 
     @QtCore.pyqtSlot()
     def nextImage(self):
+        if len(self.imagesList) == 0:
+            return
         if self.imagePos == len(self.imagesList) - 1:
             self.imagePos = 0
         else:
@@ -168,6 +273,8 @@ class qtImageCompare(QtWidgets.QMainWindow):
 
     @QtCore.pyqtSlot()
     def prevImage(self):
+        if len(self.imagesList) == 0:
+            return
         if self.imagePos == 0:
             self.imagePos = len(self.imagesList) - 1
         else:
@@ -175,19 +282,55 @@ class qtImageCompare(QtWidgets.QMainWindow):
         self.loadImage(self.imagesList[self.imagePos])
 
     def loadImage(self, path):
-        if self.calculatedImages[self.imagePos] == None:
-            (referenceImage, comparisonImage) = kMeans(path)
-            self.calculatedImages[self.imagePos] = (referenceImage, comparisonImage)
+        pixmaps = self.imageCache.get(path[1])
+        if pixmaps is None:
+            # shown by imagesLoaded as soon as the images are ready
+            self.prefetch(path)
+            self.leftImage.clear()
+            self.rightImage.clear()
+            self.statusBar().showMessage("Loading "+path[1])
         else:
-            (referenceImage, comparisonImage) = self.calculatedImages[self.imagePos]
-
-        # convert image to qimage
-        self.pixmapLeft = QtGui.QPixmap.fromImage(toQImage(referenceImage))
-        self.pixmapRight = QtGui.QPixmap.fromImage(toQImage(comparisonImage))
-
-        # show image in labels
-        self.leftImage.setPixmap(self.pixmapLeft)
-        self.rightImage.setPixmap(self.pixmapRight)
+            self.showPixmaps(pixmaps)
+
+        # prepare previous and next image in the background, drop
+        # everything the user has skipped
+        neighbours = [self.imagesList[self.imagePos - 1], self.imagesList[(self.imagePos + 1) % len(self.imagesList)]]
+        wanted = [path[1]] + [item[1] for item in neighbours]
+        for key, future in list(self.prefetching.items()):
+            if key not in wanted and future.cancel():
+                del self.prefetching[key]
+        for item in neighbours:
+            if self.imageCache.get(item[1]) is None:
+                self.prefetch(item)
+
+    def prefetch(self, path):
+        if path[1] in self.prefetching:
+            return
+        self.prefetching[path[1]] = self.prefetchPool.submit(self.prefetchImages, path)
+
+    def prefetchImages(self, path):
+        try:
+            images = prepareImages(path, self.displaySize)
+        except Exception:
+            images = [QtGui.QImage(), QtGui.QImage()]
+        self.loader.loaded.emit(path[1], images)
+
+    @QtCore.pyqtSlot(str, object)
+    def imagesLoaded(self, key, images):
+        if key in self.prefetching:
+            del self.prefetching[key]
+        pixmaps = (QtGui.QPixmap.fromImage(images[0]), QtGui.QPixmap.fromImage(images[1]))
+        # images which could not be loaded are tried again when they are shown next time
+        failed = pixmaps[0].isNull() or pixmaps[1].isNull()
+        if not failed:
+            self.imageCache.put(key, pixmaps)
+        if len(self.imagesList) > 0 and self.imagesList[self.imagePos][1] == key:
+            self.showPixmaps(pixmaps)
+            if failed:
+                self.statusBar().showMessage("Could not load "+key)
+
+    def showPixmaps(self, pixmaps):
+        self.pixmapLeft, self.pixmapRight = pixmaps
 
         self.calcPositions()
 
@@ -198,29 +341,17 @@ class qtImageCompare(QtWidgets.QMainWindow):
             self.leftImage.width(), self.leftImage.height(),
             QtCore.Qt.KeepAspectRatio,QtCore.Qt.SmoothTransformation))
 
-        md5 = self.imagesList[self.imagePos][1].split("/")[-2]
+        # refined PDF pages are not in the folder of their parameters
+        entry = self.imagesList[self.imagePos]
+        if len(entry) > 3 and 'source' in entry[3]:
+            entry = entry[3]['source']
+        md5 = entry[1].split("/")[-2]
         parameters = ""
-        for item in self.depHashes[md5]:
-            parameters = parameters + item +": "+ self.depHashes[md5][item].upper()+", "
+        for item in self.depHashes.get(md5, {}):
+            parameters = parameters + item +": "+ str(self.depHashes[md5][item]).upper()+", "
         self.statusBar().showMessage("Page "+str(self.imagePos+1)+"/"+str(len(self.imagesList))+" | "+self.imagesList[self.imagePos][1]+"\nParameters: "+parameters)
         self.setWindowTitle("dapscompare - "+self.imagesList[self.imagePos][1])
 
-        # calc previous image
-        if self.imagePos == 0:
-            prevImage = len(self.imagesList) - 1
-        else:
-            prevImage = self.imagePos - 1
-        if self.calculatedImages[prevImage] == None:
-            self.calculatedImages[prevImage] = kMeans(self.imagesList[prevImage])
-
-        # calc next image
-        if self.imagePos == len(self.imagesList) - 1:
-            nextImage = 0
-        else:
-            nextImage = self.imagePos + 1
-        if self.calculatedImages[nextImage] == None:
-            self.calculatedImages[nextImage] = kMeans(self.imagesList[nextImage])
-
     # calculate positions of elements in window
     def calcPositions(self):
         width = self.width()
@@ -257,44 +388,28 @@ class qtImageCompare(QtWidgets.QMainWindow):
         cb.setText(self.imagesList[self.imagePos][1], mode=cb.Clipboard)
 
 
-def kMeans(path):
-    # read all images
+# draw boxes around the changed regions into the comparison image
+def markRegions(path):
+    from .diff import findRegions, loadDiffMap, diffMapSuffix
     referenceImage = imread(path[0])
     comparisonImage = imread(path[1])
 
-    # flatten the diff map to reduce matrix complexity
-    diffImage = imread(path[2],flatten=True)
-
-    # get all coordinates that are not zero
-    nonzeroCoords = np.nonzero(diffImage)
-
-    # transform to 2 component vectors
-    nonzeroCoords = np.column_stack((nonzeroCoords[0],nonzeroCoords[1]))
+    # regions are found when comparing, only diff lists of older
+    # versions have to be calculated from the diff map
+    if len(path) > 3 and 'regions' in path[3]:
+        regions = path[3]['regions']
+    elif path[2].endswith(diffMapSuffix):
+        regions = loadDiffMap(path[2])[1]['regions']
+    else:
+        regions = findRegions(imread(path[2],flatten=True) > 0)
 
     # create image which can be used for drawing
     i = Image.fromarray(comparisonImage)
     draw = ImageDraw.Draw(i)
 
-    # use k-means for the first iteration
-    result = kmeans(nonzeroCoords.astype(float),1)
-    n = 0
-
-    timeout = time.time() + 3
-    # iterate k-means until the distortion is lower than 50
-    while(result[1] > 15):
-        n = n + 1
-        result = kmeans(nonzeroCoords.astype(float),n)
-
-        #not more than 10 k-means or 3 seconds
-        if n > 10 or time.time() > timeout:
-            break
-    width = int(result[1])+10
-    # draw boxes around all pixel groups
-    for x, y in result[0]:
-        x = x.astype(np.int64)
-        y = y.astype(np.int64)
-        coords = (y-width, x-width, y+width, x+width)
-        draw.rectangle((coords), fill=None, outline="red")
+    # draw boxes around all pixel groups, with some space around the change
+    for x0, y0, x1, y1 in regions:
+        draw.rectangle((x0-5, y0-5, x1+4, y1+4), fill=None, outline="red")
 
     # convert nparray to image
     comparisonImage = np.asarray(i)
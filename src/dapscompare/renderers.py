@@ -9,43 +9,530 @@
 # THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import os
-from subprocess import check_output, Popen, PIPE
-from .helpers import modeToName, registerHash
+import time
+import glob
+import math
+import json
+import queue
+import threading
+import multiprocessing
+from subprocess import check_output, Popen, PIPE, DEVNULL, TimeoutExpired, CalledProcessError
+import shutil
+import hashlib
+from .objects import storeFolder
+from .helpers import modeToName, registerHash, availableCpus, ProcessSlots, runCommands, hashPath, readManifest, writeManifest, removeManifest, clearFolder, linkFile, listFiles, cacheFolder, pageDigests, sourcesPath, pollProcess, toolPath
+from . import helpers
+from .runlog import recordProcesses, step, addOutput
 
-def renderHtml(pathHtml,pageWidth,pathPng):
-    # convert all PDF pages into numbered images and place them in reference or comparison folder
+def html2pngPath():
+    # a tools folder given with --tools can bring its own html2png.py
+    if helpers.toolsFolder != helpers.defaultToolsFolder and os.path.exists(toolPath("html2png.py")):
+        return toolPath("html2png.py")
+    return os.path.join(os.path.dirname(os.path.realpath(__file__)), "html2png.py")
+
+# targets is a list of (page width, png folder) pairs, the page is loaded once for all widths
+def htmlTargets(pathHtml,targets):
     head, tail = os.path.split(pathHtml)
-    somestring = "python3 "+os.path.join(os.path.dirname(os.path.realpath(__file__)), "html2png.py")+" "+pathHtml+" "+os.path.join(pathPng, tail+".png")+" "+str(pageWidth)
+    return [(int(pageWidth), os.path.join(pathPng, tail+".png")) for pageWidth, pathPng in targets]
+
+def renderHtml(pathHtml,targets,format="png",compression=9):
+    # convert all PDF pages into numbered images and place them in reference or comparison folder
+    somestring = "python3 "+html2pngPath()+" --format="+format+" --compression="+str(compression)+" "+pathHtml
+    for pageWidth, target in htmlTargets(pathHtml, targets):
+        somestring = somestring+" "+target+" "+str(pageWidth)
     my_env = os.environ.copy()
-    process = Popen([somestring], env=my_env, shell=True, stdout=PIPE, stderr=PIPE)
-    process.wait()
+    process = Popen([somestring], env=my_env, shell=True, stdout=DEVNULL, stderr=DEVNULL)
+    start = time.time()
+    returncode, usage = pollProcess(process, blocking=True)
+    recordProcesses([('html2png', start, time.time(), usage, somestring)])
+
+# seconds a render server may take for one page before it is killed and replaced
+htmlRenderTimeout = 300
+
+class HtmlRenderServer:
+    # long-lived html2png.py process, keeps QtWebKit loaded between pages
+    def __init__(self):
+        self.start()
+
+    def start(self):
+        my_env = os.environ.copy()
+        self.process = Popen(["python3", html2pngPath(), "--server"], env=my_env, stdin=PIPE, stdout=PIPE, stderr=DEVNULL, universal_newlines=True)
+
+    def render(self, pathHtml, targets, format="png", compression=9):
+        job = {'source': pathHtml, 'targets': htmlTargets(pathHtml, targets), 'format': format, 'compression': compression}
+        start = time.time()
+        # a page that hangs WebKit must not block the worker thread forever.
+        # Killing the server ends the readline below with an empty line.
+        deadline = threading.Timer(htmlRenderTimeout, self.process.kill)
+        deadline.start()
+        try:
+            self.process.stdin.write(json.dumps(job)+"\n")
+            self.process.stdin.flush()
+            while True:
+                line = self.process.stdout.readline()
+                if not line:
+                    break
+                try:
+                    ok = json.loads(line)['ok']
+                    recordProcesses([('html2png', start, time.time(), None, "html2png --server "+pathHtml)])
+                    return ok
+                except (ValueError, KeyError):
+                    # not an answer of the server, i.e. output of a web page
+                    continue
+        except (BrokenPipeError, OSError):
+            pass
+        finally:
+            deadline.cancel()
+        # the server died or timed out, replace it so the next page can be rendered
+        self.stop()
+        self.start()
+        return False
+
+    def stop(self):
+        try:
+            self.process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        try:
+            self.process.wait(timeout=10)
+        except TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+class HtmlRenderPool:
+    # one render server per CPU, shared by all worker threads
+    def __init__(self):
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.servers = []
+
+    def start(self, count=None):
+        if count is None:
+            count = multiprocessing.cpu_count()
+        self.lock.acquire()
+        while len(self.servers) < count:
+            server = HtmlRenderServer()
+            self.servers.append(server)
+            self.idle.put(server)
+        self.lock.release()
+
+    # render a list of (pathHtml, targets) items on one server
+    def renderBatch(self, items, format="png", compression=9):
+        if len(items) == 0:
+            return []
+        if len(self.servers) == 0:
+            self.start()
+        server = self.idle.get()
+        try:
+            return [server.render(item[0], item[1], format, compression) for item in items]
+        finally:
+            self.idle.put(server)
+
+    def stop(self):
+        self.lock.acquire()
+        for server in self.servers:
+            server.stop()
+        self.servers = []
+        self.idle = queue.Queue()
+        self.lock.release()
+
+htmlRenderPool = HtmlRenderPool()
+
+# png is the default format and not part of the hash, so old reference images stay valid
+def htmlHashParams(cfg, params):
+    if cfg.htmlFormat != "png":
+        params['Format'] = cfg.htmlFormat
+    return params
 
-def renderPdf(pathPdf,pageWidth,pathPng):
+# resolution of rendered PDF pages, if not set with --pdf-density
+defaultPdfDensity = 110
+
+# ImageMagick writes the creation time into every PNG file. Without it,
+# pages with the same pixels have the same checksum, see runTests.
+pngOptions = ["-define", "png:exclude-chunks=date,time"]
+
+def renderPdf(pathPdf,pageWidth,pathPng,density=defaultPdfDensity):
     # convert all PDF pages into numbered images and place them in reference or comparison folder
-    somestring = "/usr/bin/convert -density 110 "+pathPdf+" -quality 100 -background white -alpha remove "+pathPng+"/page-%03d.png"
+    somestring = toolPath("convert")+" -density "+str(density)+" "+pathPdf+" -quality 100 -background white -alpha remove "+" ".join(pngOptions)+" "+pathPng+"/page-%03d.png"
     my_env = os.environ.copy()
-    process = Popen([somestring], env=my_env, shell=True, stdout=PIPE, stderr=PIPE)
-    process.wait()
-
-# slower performance than native imagemagick / convert command
-def renderPdfWand(pathPdf, pathPngDir):
-    all_pages = Image(filename=pathPdf , resolution=100)        # PDF will have several pages.
-    for x, page in enumerate(all_pages.sequence):    # Just work on first page
-        with Image(page) as i:
-            i.format = 'png'
-            i.background_color = Color('white')
-            i.alpha_channel = 'remove'
-            #i.alpha_channel = False
-            #i.save(filename=pathPngDir+'/page-%s.png' % x)
-            i.save(filename=pathPngDir+'/page-%03d.png')
+    process = Popen([somestring], env=my_env, shell=True, stdout=DEVNULL, stderr=DEVNULL)
+    start = time.time()
+    returncode, usage = pollProcess(process, blocking=True)
+    recordProcesses([('convert', start, time.time(), usage, somestring)])
+
+# convert processes started by all worker threads together
+convertSlots = ProcessSlots(availableCpus())
+
+def pdfPageCount(pathPdf):
+    # Ghostscript does the rendering for convert anyway
+    escaped = pathPdf.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    try:
+        output = check_output([toolPath("gs"), "-q", "-dNODISPLAY", "-dNOSAFER", "-c", "("+escaped+") (r) file runpdfbegin pdfpagecount = quit"], stderr=DEVNULL)
+        return int(output.split()[-1])
+    except (OSError, CalledProcessError, ValueError, IndexError):
+        return 0
+
+# split the pages of all PDFs matching pathPdf into ranges and render them at the same time.
+# Without chunkSize the ranges are sized so that every free core gets one.
+def renderPdfParallel(pathPdf,pageWidth,pathPng,chunkSize=0,density=defaultPdfDensity):
+    pdfFiles = sorted(glob.glob(pathPdf))
+    pageCounts = [pdfPageCount(pdfFile) for pdfFile in pdfFiles]
+    if len(pdfFiles) == 0 or 0 in pageCounts:
+        renderPdf(pathPdf,pageWidth,pathPng,density)
+        return
+    commands = []
+    # page numbers continue over all PDFs, like in a single convert call
+    offset = 0
+    for pdfFile, pages in zip(pdfFiles, pageCounts):
+        size = chunkSize
+        if size <= 0:
+            # at least 10 pages per range, so Ghostscript start-up does not dominate
+            size = max(math.ceil(pages / max(convertSlots.free(), 1)), 10)
+        for first in range(0, pages, size):
+            last = min(first + size, pages) - 1
+            commands.append([toolPath("convert"), "-density", str(density), pdfFile+"["+str(first)+"-"+str(last)+"]", "-scene", str(offset+first), "-quality", "100", "-background", "white", "-alpha", "remove"] + pngOptions + [pathPng+"/page-%03d.png"])
+        offset = offset + pages
+    runCommands(commands, convertSlots)
+
+# global page number -> (PDF file, page in that file) for the pages of
+# all pdfFiles, numbered like the pages renderPdf writes
+def pdfPageLocations(pdfFiles, pageCounts):
+    locations = []
+    for pdfFile, pages in zip(pdfFiles, pageCounts):
+        locations.extend((pdfFile, page) for page in range(pages))
+    return locations
+
+# render single pages of the PDF files at the given density with the selected backend
+def renderPdfPages(cfg, pdfFiles, pages, density, pathPng):
+    getRenderer(cfg, 'pdf').renderPages(pdfFiles, pages, density, pathPng)
+
+# render backends. Each one renders the items of the *Items generators
+# of the file types listed in filetypes.
+class Renderer:
+    name = ""
+    filetypes = []
+
+    # False if a library or program the backend needs is missing. MyConfig
+    # then falls back to the default backend of the file type.
+    def available(self):
+        return True
+
+    # called once before the worker threads start and after they finished
+    def start(self, cfg):
+        pass
+
+    def stop(self):
+        pass
+
+    # render all items into their png folders and return when the images
+    # are written. items are those of pdfItems, htmlItems, singleHtmlItems
+    # or epubItems: (pathPdf, pageWidth, pathPng) for PDF files and
+    # (pathHtml, [(pageWidth, pathPng), ...]) for HTML files. Called by
+    # several worker threads at the same time.
+    def render(self, cfg, items):
+        raise NotImplementedError(self.name+" does not render "+", ".join(self.filetypes))
+
+    # PDF backends: render the pages with the given numbers, counted over
+    # all pdfFiles like the page-NNN.png names of render, at density dpi
+    # into pathPng.
+    def renderPages(self, pdfFiles, pages, density, pathPng):
+        raise NotImplementedError(self.name+" cannot render single pages")
+
+class ImageMagickPdfRenderer(Renderer):
+    # convert and Ghostscript in external processes
+    name = "imagemagick"
+    filetypes = ['pdf']
+
+    def render(self, cfg, items):
+        for pathPdf, pageWidth, pathPng in items:
+            if cfg.pdfParallel:
+                renderPdfParallel(pathPdf, pageWidth, pathPng, cfg.pdfChunk, cfg.pdfDensity)
+            else:
+                renderPdf(pathPdf, pageWidth, pathPng, cfg.pdfDensity)
+
+    def renderPages(self, pdfFiles, pages, density, pathPng):
+        pageCounts = [pdfPageCount(pdfFile) for pdfFile in pdfFiles]
+        locations = pdfPageLocations(pdfFiles, pageCounts)
+        commands = []
+        for n in sorted(set(pages)):
+            if n >= len(locations):
+                continue
+            pdfFile, page = locations[n]
+            commands.append([toolPath("convert"), "-density", str(density), pdfFile+"["+str(page)+"]", "-scene", str(n), "-quality", "100", "-background", "white", "-alpha", "remove"] + pngOptions + [pathPng+"/page-%03d.png"])
+        runCommands(commands, convertSlots)
+
+class MuPdfRenderer(Renderer):
+    # PyMuPDF renders the pages inside the worker thread, no processes are started
+    name = "mupdf"
+    filetypes = ['pdf']
+
+    def available(self):
+        try:
+            import fitz
+        except ImportError:
+            return False
+        return True
+
+    def render(self, cfg, items):
+        import fitz
+        zoom = cfg.pdfDensity / 72
+        for pathPdf, pageWidth, pathPng in items:
+            # page numbers continue over all PDFs, like in a single convert call
+            n = 0
+            for pdfFile in sorted(glob.glob(pathPdf)):
+                document = fitz.open(pdfFile)
+                for page in document:
+                    pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+                    pixmap.save(os.path.join(pathPng, "page-%03d.png" % n))
+                    n = n + 1
+                document.close()
+
+    def renderPages(self, pdfFiles, pages, density, pathPng):
+        import fitz
+        zoom = density / 72
+        documents = [fitz.open(pdfFile) for pdfFile in pdfFiles]
+        locations = pdfPageLocations(documents, [len(document) for document in documents])
+        for n in sorted(set(pages)):
+            if n >= len(locations):
+                continue
+            document, page = locations[n]
+            pixmap = document[page].get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            pixmap.save(os.path.join(pathPng, "page-%03d.png" % n))
+        for document in documents:
+            document.close()
+
+class WebKitServerRenderer(Renderer):
+    # html2png render servers, see HtmlRenderPool
+    name = "server"
+    filetypes = ['html', 'single-html', 'epub']
+
+    def start(self, cfg):
+        # start render servers now, they load QtWebKit while daps is compiling
+        htmlRenderPool.start()
+
+    def stop(self):
+        htmlRenderPool.stop()
+
+    def render(self, cfg, items):
+        htmlRenderPool.renderBatch(items, cfg.htmlFormat, cfg.htmlCompression)
+
+class WebKitProcessRenderer(Renderer):
+    # one html2png process per HTML file
+    name = "process"
+    filetypes = ['html', 'single-html', 'epub']
+
+    def render(self, cfg, items):
+        for pathHtml, targets in items:
+            renderHtml(pathHtml, targets, cfg.htmlFormat, cfg.htmlCompression)
+
+pdfBackends = {}
+htmlBackends = {}
+for backend in [ImageMagickPdfRenderer(), MuPdfRenderer()]:
+    pdfBackends[backend.name] = backend
+for backend in [WebKitServerRenderer(), WebKitProcessRenderer()]:
+    htmlBackends[backend.name] = backend
+
+def getRenderer(cfg, filetype):
+    if filetype == 'pdf':
+        return pdfBackends[cfg.pdfBackend]
+    if filetype in ('html', 'single-html', 'epub'):
+        return htmlBackends[cfg.htmlBackend]
+    return None
+
+# backends used for the configured file types
+def activeRenderers(cfg):
+    result = []
+    for filetype in cfg.filetypes:
+        if filetype != 'pdf' and cfg.noGui:
+            continue
+        renderer = getRenderer(cfg, filetype)
+        # unknown file types are ignored, as in runRenderers
+        if renderer is not None and renderer not in result:
+            result.append(renderer)
+    return result
+
+# content hashes of build output folders, computed once per run
+folderHashes = {}
+folderHashesLock = threading.Lock()
+
+def cachedFolderHash(folder):
+    folderHashesLock.acquire()
+    if folder not in folderHashes:
+        folderHashes[folder] = hashPath(folder)
+    folderHashesLock.release()
+    return folderHashes[folder]
+
+def renderKey(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+
+# (png folder, render key) for every target of a render item. The key is
+# built from the content of the rendered file and all parameters that
+# change the images, or None if there is nothing to render.
+def itemKeys(cfg, filetype, item):
+    if filetype == 'pdf':
+        pathPdf, pageWidth, pathPng = item
+        pdfFiles = sorted(glob.glob(pathPdf))
+        if len(pdfFiles) == 0:
+            return [(pathPng, None)]
+        return [(pathPng, renderKey({'Type': 'pdf', 'Backend': cfg.pdfBackend, 'Density': cfg.pdfDensity, 'Files': [hashPath(pdfFile) for pdfFile in pdfFiles]}))]
+    pathHtml, targets = item
+    # HTML pages depend on images and stylesheets next to them
+    folder = os.path.dirname(pathHtml)
+    params = {'Type': filetype, 'Format': cfg.htmlFormat, 'File': os.path.basename(pathHtml), 'Folder': cachedFolderHash(folder)}
+    result = []
+    for pageWidth, pathPng in targets:
+        params['Width'] = int(pageWidth)
+        result.append((pathPng, renderKey(params)))
+    return result
+
+# copy of an item with only the given png folders as targets
+def itemForFolders(filetype, item, folders):
+    if filetype == 'pdf':
+        return item
+    return (item[0], [(pageWidth, pathPng) for pageWidth, pathPng in item[1] if pathPng in folders])
+
+def restoreRenderCache(cfg, key, folder):
+    source = cacheFolder(cfg, "render", key)
+    if not os.path.isdir(source):
+        return False
+    for filename in listFiles(source+"/"):
+        linkFile(os.path.join(source, filename), os.path.join(folder, filename))
+    # the modification time of an entry is its last use, see pruneRenderCache
+    os.utime(source)
+    return True
+
+# remove the least recently used entries until the cache holds at most
+# cfg.renderCacheSize MB. Returns the number of removed entries. Objects
+# of the store which were only linked from them are pruned afterwards.
+def pruneRenderCache(cfg):
+    root = cacheFolder(cfg, "render")
+    if not os.path.isdir(root):
+        return 0
+    entries = []
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if not os.path.isdir(path) or ".tmp-" in name:
+            continue
+        size = sum(os.path.getsize(os.path.join(path, filename)) for filename in listFiles(path))
+        entries.append((os.path.getmtime(path), size, path))
+    total = sum(size for mtime, size, path in entries)
+    removed = 0
+    for mtime, size, path in sorted(entries):
+        if total <= cfg.renderCacheSize * 1024 * 1024:
+            break
+        shutil.rmtree(path)
+        removeManifest(path)
+        total = total - size
+        removed = removed + 1
+    return removed
+
+# manifest of a folder restored from a cache entry. The checksums and
+# perceptual hashes of the pages are stored next to the entry like the
+# manifest of a page folder. Older entries have no checksums.
+def restoredManifest(cfg, key, folder):
+    cached = readManifest(cacheFolder(cfg, "render", key))
+    manifest = {'artifact': key, 'pages': cached.get('pages')}
+    if manifest['pages'] is None:
+        manifest['pages'] = pageDigests(folder)
+    if 'phash' in cached:
+        manifest['phash'] = cached['phash']
+    return manifest
+
+# perceptual hashes are only computed when the page count of a document
+# changed. Keep them in the manifest of the folder and of its cache entry.
+def storePageHashes(cfg, folder, manifest):
+    writeManifest(folder, manifest)
+    key = manifest.get('artifact')
+    entry = cacheFolder(cfg, "render", key) if key is not None else None
+    if cfg.renderCache and entry is not None and os.path.isdir(entry):
+        cached = readManifest(entry)
+        if 'pages' in cached:
+            cached['phash'] = manifest['phash']
+            writeManifest(entry, cached)
+
+def storeRenderCache(cfg, key, folder, digests):
+    target = cacheFolder(cfg, "render", key)
+    if os.path.exists(target):
+        return
+    # fill a temporary folder first, so other threads never see half a cache entry
+    temp = target+".tmp-"+str(threading.get_ident())
+    os.makedirs(temp)
+    for filename in listFiles(folder):
+        linkFile(os.path.join(folder, filename), os.path.join(temp, filename))
+    try:
+        os.rename(temp, target)
+    except OSError:
+        shutil.rmtree(temp)
+        return
+    writeManifest(target, {'pages': digests})
+
+# render the items of a file type, but take the pages of files which
+# were rendered before from the render cache
+def renderCached(cfg, filetype, items):
+    renderer = getRenderer(cfg, filetype)
+    missing = []
+    rendered = []
+    allFolders = []
+    for item in items:
+        folders = []
+        for folder, key in itemKeys(cfg, filetype, item):
+            allFolders.append(folder)
+            clearFolder(folder)
+            if key is not None and cfg.renderCache and restoreRenderCache(cfg, key, folder):
+                writeManifest(folder, restoredManifest(cfg, key, folder))
+                continue
+            folders.append(folder)
+            rendered.append((folder, key))
+        if len(folders) > 0:
+            missing.append(itemForFolders(filetype, item, folders))
+    if len(missing) > 0:
+        with step(renderer.name):
+            renderer.render(cfg, missing)
+    for folder, key in rendered:
+        if key is None:
+            continue
+        # the checksums of the pages let runTests skip identical pages
+        digests = pageDigests(folder)
+        if cfg.dedupe:
+            storeFolder(cfg, folder, digests)
+        if cfg.renderCache and len(digests) > 0:
+            storeRenderCache(cfg, key, folder, digests)
+        writeManifest(folder, {'artifact': key, 'pages': digests})
+        addOutput(len(digests), sum(os.path.getsize(os.path.join(folder, filename)) for filename in digests))
+    if cfg.refStore and cfg.mode == 1:
+        from .pagestore import buildPageStore
+        for folder in allFolders:
+            if len(listFiles(folder)) > 0:
+                buildPageStore(folder)
+
+# imagemagick and the default density are not part of the hash, so old reference images stay valid
+def pdfHashParams(cfg, params):
+    if cfg.pdfBackend != "imagemagick":
+        params['Backend'] = cfg.pdfBackend
+    if cfg.pdfDensity != defaultPdfDensity:
+        params['Density'] = cfg.pdfDensity
+    return params
 
 #find the PDF files in build folder and convert to png
 def pdfItems(testcase,cfg,dataCollection):
-    folderName = testcase+modeToName(cfg.mode)+"/"+registerHash({'Type': 'pdf', 'testcase': testcase},dataCollection)
+    folderName = testcase+modeToName(cfg.mode)+"/"+registerHash(pdfHashParams(cfg, {'Type': 'pdf', 'testcase': testcase}),dataCollection)
     if not os.path.exists(folderName):
         os.makedirs(folderName)
+    if cfg.mode == 1 and cfg.pdfRefine > cfg.pdfDensity:
+        keepPdfSources(testcase+"build/*/*.pdf", folderName)
     yield (testcase+"build/*/*.pdf",100,folderName)
 
+# the next build replaces the reference PDFs. Keep links to them, numbered
+# in the order their pages are rendered, for --pdf-refine. compileTestcase
+# removes the build folder before daps runs, so the links stay valid.
+def keepPdfSources(pathPdf, folder):
+    sources = sourcesPath(folder)
+    if os.path.exists(sources):
+        shutil.rmtree(sources)
+    os.makedirs(sources)
+    for n, pdfFile in enumerate(sorted(glob.glob(pathPdf))):
+        linkFile(pdfFile, os.path.join(sources, "%03d-%s" % (n, os.path.basename(pdfFile))))
+
 #find HTML files in build folder and convert to png
 def htmlItems(testcase,cfg,dataCollection):
     for build in os.listdir(testcase+"build"):
@@ -54,12 +541,14 @@ def htmlItems(testcase,cfg,dataCollection):
                 for htmlFile in os.listdir(testcase+"build/"+build+"/html/"+htmlBuild):
                     if not htmlFile.endswith(".html"):
                         continue
+                    targets = []
                     for width in cfg.htmlWidth:
-                        folderName = testcase+modeToName(cfg.mode)+"/"+registerHash({'Type': 'html', 'Width': str(width), 'File': htmlBuild+"/"+htmlFile, 'testcase': testcase},dataCollection)+"/"
+                        folderName = testcase+modeToName(cfg.mode)+"/"+registerHash(htmlHashParams(cfg, {'Type': 'html', 'Width': str(width), 'File': htmlBuild+"/"+htmlFile, 'testcase': testcase}),dataCollection)+"/"
                         if not os.path.exists(folderName):
                             os.makedirs(folderName)
-                        if not os.path.islink(testcase+"build/"+build+"/html/"+htmlBuild+"/"+htmlFile):
-                            yield (testcase+"build/"+build+"/html/"+htmlBuild+"/"+htmlFile,width,folderName)
+                        targets.append((width,folderName))
+                    if not os.path.islink(testcase+"build/"+build+"/html/"+htmlBuild+"/"+htmlFile):
+                        yield (testcase+"build/"+build+"/html/"+htmlBuild+"/"+htmlFile,targets)
 
 #find Single HTML files in build folder and convert to png
 def singleHtmlItems(testcase,cfg,dataCollection):
@@ -69,12 +558,14 @@ def singleHtmlItems(testcase,cfg,dataCollection):
                 for htmlFile in os.listdir(testcase+"build/"+build+"/single-html/"+htmlBuild):
                     if not htmlFile.endswith(".html"):
                         continue
+                    targets = []
                     for width in cfg.htmlWidth:
-                        folderName = testcase+modeToName(cfg.mode)+"/"+registerHash({'Type': 'single-html', 'Width': str(width), 'File': htmlBuild+htmlFile, 'testcase': testcase},dataCollection)+"/"
+                        folderName = testcase+modeToName(cfg.mode)+"/"+registerHash(htmlHashParams(cfg, {'Type': 'single-html', 'Width': str(width), 'File': htmlBuild+htmlFile, 'testcase': testcase}),dataCollection)+"/"
                         if not os.path.exists(folderName):
                             os.makedirs(folderName)
-                        if not os.path.islink(testcase+"build/"+build+"/single-html/"+htmlBuild+"/"+htmlFile):
-                            yield (testcase+"build/"+build+"/single-html/"+htmlBuild+"/"+htmlFile,width,folderName)
+                        targets.append((width,folderName))
+                    if not os.path.islink(testcase+"build/"+build+"/single-html/"+htmlBuild+"/"+htmlFile):
+                        yield (testcase+"build/"+build+"/single-html/"+htmlBuild+"/"+htmlFile,targets)
 
 #find EPUB files in build folder and convert to png
 def epubItems(testcase,cfg,dataCollection):
@@ -83,15 +574,19 @@ def epubItems(testcase,cfg,dataCollection):
         if not build.startswith("."):
             for epub in os.listdir(testcase+"build/"+build+"/"):
                 if epub.endswith(".epub"):
-                    os.makedirs(testcase+"build/"+build+"/"+epub[0:-5]+"/")
-                    with zipfile.ZipFile(testcase+"build/"+build+"/"+epub, 'r') as zip_ref:
-                        zip_ref.extractall(testcase+"build/"+build+"/"+epub[0:-5]+"/")
+                    # a build reused from the build cache is already extracted
+                    if not os.path.exists(testcase+"build/"+build+"/"+epub[0:-5]+"/"):
+                        os.makedirs(testcase+"build/"+build+"/"+epub[0:-5]+"/")
+                        with zipfile.ZipFile(testcase+"build/"+build+"/"+epub, 'r') as zip_ref:
+                            zip_ref.extractall(testcase+"build/"+build+"/"+epub[0:-5]+"/")
                     for htmlFile in os.listdir(testcase+"build/"+build+"/"+epub[0:-5]+"/OEBPS/"):
                         if not htmlFile.endswith(".html"):
                             continue
+                        targets = []
                         for width in cfg.htmlWidth:
-                            folderName = testcase+modeToName(cfg.mode)+"/"+registerHash({'Type': 'epub', 'Width': str(width), 'File': epub, 'HTML File': htmlFile, 'testcase': testcase},dataCollection)+"/"
+                            folderName = testcase+modeToName(cfg.mode)+"/"+registerHash(htmlHashParams(cfg, {'Type': 'epub', 'Width': str(width), 'File': epub, 'HTML File': htmlFile, 'testcase': testcase}),dataCollection)+"/"
                             if not os.path.exists(folderName):
                                 os.makedirs(folderName)
-                            if not os.path.islink(testcase+"build/"+build+"/"+epub[0:-5]+"/OEBPS/"+htmlFile):
-                                yield (testcase+"build/"+build+"/"+epub[0:-5]+"/OEBPS/"+htmlFile,width,folderName)
+                            targets.append((width,folderName))
+                        if not os.path.islink(testcase+"build/"+build+"/"+epub[0:-5]+"/OEBPS/"+htmlFile):
+                            yield (testcase+"build/"+build+"/"+epub[0:-5]+"/OEBPS/"+htmlFile,targets)
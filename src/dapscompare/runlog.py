@@ -0,0 +1,247 @@
+# The MIT License (MIT)
+# 
+# Copyright (c) 2017, Sven Seeberg-Elverfeldt <sseebergelverfeldt@suse.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# Timing of every pipeline stage of every testcase. A span covers one
+# stage of one testcase: wall and CPU time of the worker thread, CPU time
+# and peak memory of the processes it started, pages and bytes it wrote
+# and the time spent in named steps like imread. Every run appends one
+# line to dapscompare-runs.jsonl; "dapscmp stats" summarizes the last runs.
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+from .helpers import readFile
+
+# span of the stage the current worker thread works on
+current = threading.local()
+
+
+def threadTime():
+    return time.clock_gettime(time.CLOCK_THREAD_CPUTIME_ID)
+
+
+def testcaseName(testcase):
+    return os.path.basename(testcase.rstrip("/"))
+
+
+# peak memory of processes which ran at the same time. processes is a
+# list of (start, end, peak RSS in bytes).
+def concurrentPeak(processes):
+    events = []
+    for start, end, rss in processes:
+        events.append((start, rss))
+        events.append((end, -rss))
+    # at the same time, processes end before new ones start
+    events.sort(key=lambda event: (event[0], event[1]))
+    peak = 0
+    total = 0
+    for moment, rss in events:
+        total = total + rss
+        peak = max(peak, total)
+    return peak
+
+
+class Span:
+    def __init__(self, testcase, stage):
+        self.testcase = testcase
+        self.stage = stage
+        self.start = time.time()
+        self.cpuStart = threadTime()
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.childCpu = 0.0
+        self.rss = 0
+        self.pages = 0
+        self.bytes = 0
+        self.steps = {}
+        # program name -> [number of processes, seconds they ran]
+        self.processes = {}
+
+    def finish(self):
+        self.wall = time.time() - self.start
+        self.cpu = threadTime() - self.cpuStart
+
+    def record(self, runStart):
+        return {'testcase': testcaseName(self.testcase), 'stage': self.stage, 'start': round(self.start - runStart, 3), 'wall': round(self.wall, 3), 'cpu': round(self.cpu, 3), 'childCpu': round(self.childCpu, 3), 'rss': self.rss, 'pages': self.pages, 'bytes': self.bytes, 'steps': dict((name, round(seconds, 3)) for name, seconds in self.steps.items()), 'processes': self.processes}
+
+
+class RunLog:
+    def __init__(self):
+        self.start = time.time()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def begin(self, testcase, stage):
+        current.span = Span(testcase, stage)
+        return current.span
+
+    def end(self, span):
+        span.finish()
+        current.span = None
+        self.lock.acquire()
+        self.spans.append(span)
+        self.lock.release()
+
+    def write(self, cfg, duration):
+        run = {'start': self.start, 'mode': cfg.mode, 'duration': round(duration, 3), 'spans': [span.record(self.start) for span in self.spans]}
+        f = open(cfg.directory+cfg.runLogFile, 'a')
+        f.write(json.dumps(run, sort_keys=True)+"\n")
+        f.close()
+
+
+# time spent in a part of a stage, e.g. with step('imread'): ...
+@contextmanager
+def step(name):
+    start = time.time()
+    try:
+        yield
+    finally:
+        span = getattr(current, 'span', None)
+        if span is not None:
+            span.steps[name] = span.steps.get(name, 0.0) + time.time() - start
+
+
+# profiler of the current run, see profiling.py
+profiler = None
+
+
+# called with (program, start, end, resource usage, command line) of
+# finished processes. Jobs of a render server count as processes
+# without resource usage.
+def recordProcesses(processes):
+    if profiler is not None:
+        for name, start, end, usage, command in processes:
+            profiler.addCommand(command, end - start)
+    span = getattr(current, 'span', None)
+    if span is None or len(processes) == 0:
+        return
+    for name, start, end, usage, command in processes:
+        entry = span.processes.setdefault(name, [0, 0.0])
+        entry[0] = entry[0] + 1
+        entry[1] = round(entry[1] + end - start, 3)
+        if usage is not None:
+            span.childCpu = span.childCpu + usage.ru_utime + usage.ru_stime
+    # ru_maxrss is in kilobytes on Linux
+    peak = concurrentPeak([(start, end, usage.ru_maxrss * 1024 if usage is not None else 0) for name, start, end, usage, command in processes])
+    span.rss = max(span.rss, peak)
+
+
+# files written by the current stage
+def addOutput(pages=0, size=0):
+    span = getattr(current, 'span', None)
+    if span is not None:
+        span.pages = span.pages + pages
+        span.bytes = span.bytes + size
+
+
+def readRuns(cfg, count):
+    content = readFile(cfg.directory+cfg.runLogFile)
+    if not content:
+        return []
+    runs = []
+    for line in content.splitlines()[-count:]:
+        try:
+            runs.append(json.loads(line))
+        except ValueError:
+            pass
+    return runs
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2 == 1:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+# seconds of every (testcase, stage) of a run
+def spanTimes(run):
+    times = {}
+    for span in run['spans']:
+        key = (span['testcase'], span['stage'])
+        times[key] = times.get(key, 0.0) + span['wall']
+    return times
+
+
+# stages of the last run which took regressionFactor times as long as
+# the median of the runs before, and at least regressionSeconds longer
+regressionFactor = 1.25
+regressionSeconds = 1.0
+
+def findRegressions(runs):
+    # reference runs have no diff stage and are only compared to each other
+    earlier = [spanTimes(run) for run in runs[:-1] if run['mode'] == runs[-1]['mode']]
+    if len(earlier) == 0:
+        return []
+    last = spanTimes(runs[-1])
+    result = []
+    for key, seconds in last.items():
+        before = [times[key] for times in earlier if key in times]
+        if len(before) == 0:
+            continue
+        typical = median(before)
+        if seconds > typical * regressionFactor and seconds - typical > regressionSeconds:
+            result.append((key, typical, seconds))
+    return sorted(result, key=lambda item: item[2] - item[1], reverse=True)
+
+
+def printStats(cfg):
+    runs = readRuns(cfg, cfg.statsRuns)
+    if len(runs) == 0:
+        print("No runs in "+cfg.directory+cfg.runLogFile)
+        return
+    print("\n=== Runs ===\n")
+    for run in runs:
+        print("%s  %-9s %8.1f s  %4d spans" % (time.strftime("%Y-%m-%d %H:%M", time.localtime(run['start'])), modeName(run['mode']), run['duration'], len(run['spans'])))
+
+    last = runs[-1]
+    testcases = {}
+    stages = {}
+    for span in last['spans']:
+        testcases[span['testcase']] = testcases.get(span['testcase'], 0.0) + span['wall']
+        stage = stages.setdefault(span['stage'], {'wall': 0.0, 'cpu': 0.0, 'childCpu': 0.0, 'rss': 0, 'pages': 0, 'bytes': 0})
+        for field in ['wall', 'cpu', 'childCpu', 'pages', 'bytes']:
+            stage[field] = stage[field] + span[field]
+        stage['rss'] = max(stage['rss'], span['rss'])
+
+    print("\n=== Slowest Testcases (last run) ===\n")
+    for name, seconds in sorted(testcases.items(), key=lambda item: item[1], reverse=True)[:10]:
+        print("%8.1f s  %s" % (seconds, name))
+
+    print("\n=== Stages (last run) ===\n")
+    for name, stage in sorted(stages.items(), key=lambda item: item[1]['wall'], reverse=True):
+        print("%-8s %8.1f s wall, %8.1f s cpu, %8.1f s child cpu, peak %6d MB, %5d pages, %8d kB" % (name, stage['wall'], stage['cpu'], stage['childCpu'], stage['rss'] // 2**20, stage['pages'], stage['bytes'] // 1024))
+
+    # steps and processes, summed over all testcases
+    parts = {}
+    for span in last['spans']:
+        for name, seconds in span['steps'].items():
+            parts[name] = parts.get(name, 0.0) + seconds
+        for name, (count, seconds) in span['processes'].items():
+            parts[name+" (processes)"] = parts.get(name+" (processes)", 0.0) + seconds
+    if len(parts) > 0:
+        print("\n=== Slowest Steps (last run) ===\n")
+        for name, seconds in sorted(parts.items(), key=lambda item: item[1], reverse=True)[:10]:
+            print("%8.1f s  %s" % (seconds, name))
+
+    regressions = findRegressions(runs)
+    if len(regressions) > 0:
+        print("\n=== Slower Than Before ===\n")
+        for (testcase, stage), before, seconds in regressions:
+            print("%-8s %s: %.1f s -> %.1f s" % (stage, testcase, before, seconds))
+
+
+def modeName(mode):
+    return {1: "reference", 2: "compare"}.get(mode, str(mode))
@@ -0,0 +1,141 @@
+# The MIT License (MIT)
+# 
+# Copyright (c) 2017, Sven Seeberg-Elverfeldt <sseebergelverfeldt@suse.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+# Order and admission of testcases. The duration of every stage and the
+# peak memory of the processes started for a testcase, measured as in
+# runlog.py, are kept in dapscompare-history.json. Testcases which took
+# longest last time start first, and a testcase is only compiled when
+# the memory it needed last time is available.
+
+import json
+import heapq
+import threading
+
+from .helpers import readFile, writeFile
+from .runlog import testcaseName
+
+# duration of a pipeline with the given stages, if every testcase took as
+# long as in durations. stages is a list of (name, workers).
+def simulatePipeline(testcases, stages, durations):
+    ready = dict((testcase, 0.0) for testcase in testcases)
+    end = 0.0
+    for name, workers in stages:
+        free = [0.0] * workers
+        # testcases enter a stage in the order they leave the previous one
+        for testcase in sorted(testcases, key=lambda testcase: ready[testcase]):
+            start = max(ready[testcase], heapq.heappop(free))
+            ready[testcase] = start + durations[testcase].get(name, 0.0)
+            heapq.heappush(free, ready[testcase])
+            end = max(end, ready[testcase])
+    return end
+
+
+class Scheduler:
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.path = cfg.directory+cfg.historyFile
+        self.history = {}
+        content = readFile(self.path)
+        if content:
+            try:
+                self.history = json.loads(content)
+            except ValueError:
+                pass
+        self.lock = threading.Condition()
+        # measurements of this run
+        self.stages = {}
+        self.memory = {}
+        # testcases in the pipeline and the memory they are expected to need
+        self.running = {}
+
+    # history of a testcase, testcases without one count as average
+    def expected(self, testcase):
+        name = testcaseName(testcase)
+        if name in self.history:
+            return self.history[name]
+        known = list(self.history.values())
+        if len(known) == 0:
+            return {'stages': {}, 'rss': 0}
+        stages = {}
+        for entry in known:
+            for stage, seconds in entry['stages'].items():
+                stages[stage] = stages.get(stage, 0.0) + seconds / len(known)
+        return {'stages': stages, 'rss': sum(entry['rss'] for entry in known) // len(known)}
+
+    def duration(self, testcase):
+        return sum(self.expected(testcase)['stages'].values())
+
+    # longest processing time first
+    def order(self, testcases):
+        return sorted(testcases, key=self.duration, reverse=True)
+
+    def predictMakespan(self, testcases, stages):
+        durations = dict((testcase, self.expected(testcase)['stages']) for testcase in testcases)
+        return simulatePipeline(testcases, stages, durations)
+
+    def available(self):
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.virtual_memory().available
+
+    # block until there is enough memory for the testcase. A testcase is
+    # always admitted when no other one is running. The memory of the
+    # admitted testcases counts as used, their processes may not have
+    # started yet.
+    def admit(self, testcase):
+        need = self.expected(testcase)['rss']
+        reserve = self.cfg.memoryReserve * 1024 * 1024
+        self.lock.acquire()
+        while len(self.running) > 0:
+            available = self.available()
+            if available is None or available - reserve - sum(self.running.values()) >= need:
+                break
+            self.lock.wait(1.0)
+        self.running[testcase] = need
+        self.lock.release()
+
+    # the testcase left the pipeline
+    def finish(self, testcase):
+        self.lock.acquire()
+        self.running.pop(testcase, None)
+        self.lock.notify_all()
+        self.lock.release()
+
+    def addTime(self, testcase, stage, seconds):
+        self.lock.acquire()
+        stages = self.stages.setdefault(testcaseName(testcase), {})
+        stages[stage] = stages.get(stage, 0.0) + seconds
+        self.lock.release()
+
+    def addMemory(self, testcase, rss):
+        self.lock.acquire()
+        name = testcaseName(testcase)
+        self.memory[name] = max(self.memory.get(name, 0), rss)
+        self.lock.release()
+
+    # reference runs have no diff stage, the one of the last comparison is
+    # kept. The testcases in skip are not updated. A higher peak memory is
+    # taken over at once, a lower one only half way, so one run which
+    # needed little memory does not let too many testcases in next time.
+    def save(self, skip=[]):
+        skip = set(testcaseName(testcase) for testcase in skip)
+        for name, stages in self.stages.items():
+            if name in skip:
+                continue
+            entry = self.history.setdefault(name, {'stages': {}, 'rss': 0})
+            entry['stages'].update(stages)
+            rss = self.memory.get(name, 0)
+            if rss < entry['rss']:
+                rss = (entry['rss'] + rss) // 2
+            entry['rss'] = rss
+        writeFile(self.path, json.dumps(self.history, sort_keys=True))
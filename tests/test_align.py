@@ -0,0 +1,59 @@
+from PIL import Image
+
+from dapscompare.align import alignPages, gapCost, pageSortKey, perceptualHash
+
+
+def test_equal_pages():
+    hashes = ["0000000000000000", "ffffffffffffffff", "00000000ffffffff"]
+    assert alignPages(hashes, hashes) == [(0, 0), (1, 1), (2, 2)]
+
+
+def test_inserted_page():
+    ref = ["0000000000000000", "ffffffffffffffff"]
+    comp = ["0000000000000000", "0f0f0f0f0f0f0f0f", "ffffffffffffffff"]
+    assert alignPages(ref, comp) == [(0, 0), (None, 1), (1, 2)]
+
+
+def test_removed_page():
+    ref = ["0000000000000000", "0f0f0f0f0f0f0f0f", "ffffffffffffffff"]
+    comp = ["0000000000000000", "ffffffffffffffff"]
+    assert alignPages(ref, comp) == [(0, 0), (1, None), (2, 1)]
+
+
+def test_changed_page_is_paired():
+    # fewer differing bits than two gaps cost
+    ref = ["0000000000000000"]
+    comp = ["%016x" % (2 ** (2 * gapCost - 1) - 1)]
+    assert alignPages(ref, comp) == [(0, 0)]
+
+
+def test_different_page_is_not_paired():
+    ref = ["0000000000000000"]
+    comp = ["ffffffffffffffff"]
+    assert sorted(alignPages(ref, comp), key=str) == sorted([(0, None), (None, 0)], key=str)
+
+
+def test_empty():
+    assert alignPages([], []) == []
+    assert alignPages(["0000000000000000"], []) == [(0, None)]
+    assert alignPages([], ["0000000000000000"]) == [(None, 0)]
+
+
+def test_page_sort_key():
+    assert sorted(["page-10.png", "page-9.png", "page-100.png"], key=pageSortKey) == ["page-9.png", "page-10.png", "page-100.png"]
+
+
+def test_perceptual_hash(tmp_path):
+    path = str(tmp_path / "page.png")
+    image = Image.new("L", (90, 80), 255)
+    # pixels only get darker from left to right, no bit is set
+    image.paste(0, (45, 0, 90, 80))
+    image.save(path)
+    assert perceptualHash(path) == "0000000000000000"
+    # brighter right neighbours at the edge, the same in every row
+    image = Image.new("L", (90, 80), 0)
+    image.paste(255, (45, 0, 90, 80))
+    image.save(path)
+    value = perceptualHash(path)
+    assert value != "0000000000000000"
+    assert len(set(value[n:n + 2] for n in range(0, 16, 2))) == 1
@@ -0,0 +1,89 @@
+import numpy as np
+
+from dapscompare.diff import diffImages, findRegions, saveDiffMap, loadDiffMap, sizeMetrics
+
+
+def page(height=32, width=32, value=255):
+    return np.full((height, width, 3), value, dtype=np.uint8)
+
+
+def test_identical_pages():
+    metrics, mask = diffImages(page(), page())
+    assert metrics == {'changed': 0, 'maxDelta': 0, 'regions': []}
+    assert not mask.any()
+
+
+def test_different_size():
+    assert diffImages(page(32, 32), page(32, 40)) is None
+
+
+def test_size_metrics():
+    metrics = sizeMetrics(page(32, 32), page(32, 40))
+    assert metrics['changed'] == 32 * 40
+    assert metrics['sizes'] == [[32, 32], [32, 40]]
+
+
+def test_no_wrap_around():
+    # 0 - 255 must not wrap to 1 with uint8 arithmetic
+    comp = page()
+    comp[0, 0] = 0
+    metrics, mask = diffImages(page(), comp)
+    assert metrics['changed'] == 1
+    assert metrics['maxDelta'] == 255
+
+
+def test_tolerance():
+    comp = page()
+    comp[5, 5] = 250
+    comp[20, 20] = 200
+    metrics, mask = diffImages(page(), comp, tolerance=10)
+    assert metrics['changed'] == 1
+    assert mask[20, 20] and not mask[5, 5]
+
+
+def test_channel_tolerance():
+    comp = page()
+    comp[3, 3] = (255, 250, 255)
+    # the last value is used for all further channels
+    assert diffImages(page(), comp, tolerance=[0, 10])[0]['changed'] == 0
+    assert diffImages(page(), comp, tolerance=[10, 0])[0]['changed'] == 1
+
+
+def test_aa_threshold():
+    comp = page()
+    # faint noise far away from any real change
+    comp[2, 2] = 250
+    # a real change with a faint edge next to it
+    comp[20, 20] = 0
+    comp[20, 21] = 250
+    metrics, mask = diffImages(page(), comp, aaThreshold=10)
+    assert not mask[2, 2]
+    assert mask[20, 20] and mask[20, 21]
+    assert metrics['changed'] == 2
+
+
+def test_regions():
+    mask = np.zeros((40, 40), dtype=bool)
+    mask[1, 1] = True
+    mask[2, 9] = True
+    mask[35, 35] = True
+    # neighbouring blocks are merged, the region is clipped to the image
+    assert sorted(findRegions(mask)) == [[0, 0, 16, 8], [32, 32, 40, 40]]
+
+
+def test_regions_of_diff():
+    comp = page(20, 20)
+    comp[18, 18] = 0
+    metrics, mask = diffImages(page(20, 20), comp)
+    assert metrics['regions'] == [[16, 16, 20, 20]]
+
+
+def test_diff_map_round_trip(tmp_path):
+    mask = np.zeros((13, 7), dtype=bool)
+    mask[4, 2] = True
+    metrics = {'changed': 1, 'maxDelta': 9, 'regions': [[0, 0, 7, 8]]}
+    path = str(tmp_path / "page.npz")
+    saveDiffMap(path, mask, metrics)
+    loadedMask, loadedMetrics = loadDiffMap(path)
+    assert (loadedMask == mask).all()
+    assert loadedMetrics == metrics
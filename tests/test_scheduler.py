@@ -0,0 +1,34 @@
+import threading
+from types import SimpleNamespace
+
+from dapscompare.scheduler import Scheduler
+
+
+def newScheduler(tmp_path, history):
+    cfg = SimpleNamespace(directory=str(tmp_path)+"/", historyFile="history.json", memoryReserve=0)
+    scheduler = Scheduler(cfg)
+    scheduler.history = history
+    return scheduler
+
+
+def test_admit_counts_running_testcases(tmp_path):
+    scheduler = newScheduler(tmp_path, {'a': {'stages': {}, 'rss': 600}, 'b': {'stages': {}, 'rss': 600}})
+    scheduler.available = lambda: 1000
+    scheduler.admit("/tests/a/")
+    second = threading.Thread(target=scheduler.admit, args=("/tests/b/",))
+    second.start()
+    # both fit into the free memory alone, but not together
+    second.join(0.5)
+    assert second.is_alive()
+    scheduler.finish("/tests/a/")
+    second.join(5)
+    assert not second.is_alive()
+    assert list(scheduler.running) == ["/tests/b/"]
+
+
+def test_admit_without_memory_information(tmp_path):
+    scheduler = newScheduler(tmp_path, {'a': {'stages': {}, 'rss': 600}, 'b': {'stages': {}, 'rss': 600}})
+    scheduler.available = lambda: None
+    scheduler.admit("/tests/a/")
+    scheduler.admit("/tests/b/")
+    assert len(scheduler.running) == 2